@@ -0,0 +1,189 @@
+from typing import Iterator, List, Optional
+import argparse
+import json
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+import pymongo.database
+from pymongo import UpdateOne
+from pymongo.server_api import ServerApi
+from pymongo.mongo_client import MongoClient
+import bulk
+import catalog
+import storage
+import data_controller as data
+
+# One row per user and one column per catalog entry: owned characters, then
+# material and furnishing quantities, then claims by set and character. The
+# names behind the columns are kept in the file's metadata, so a file written
+# under an older catalog still imports.
+
+
+def layout(cat: catalog.Catalog) -> dict:
+    return {
+        "characters": cat.characters.tolist(),
+        "materials": cat.materials.tolist(),
+        "furnishings": cat.furnishings.tolist(),
+        "pairs": [list(pair) for pair in cat.pairs],
+    }
+
+
+def inventory_schema(cat: catalog.Catalog) -> pa.Schema:
+    names = layout(cat)
+    fields = [pa.field("user_id", pa.string()), pa.field("revision", pa.int64())]
+    fields += [
+        pa.field(f"characters.{name}", pa.bool_()) for name in names["characters"]
+    ]
+    for kind in ("materials", "furnishings"):
+        fields += [pa.field(f"{kind}.{name}", pa.int32()) for name in names[kind]]
+    fields += [
+        pa.field(f"sets.{name}.{char}", pa.bool_()) for name, char in names["pairs"]
+    ]
+
+    return pa.schema(
+        fields,
+        metadata={
+            "catalog_version": str(cat.version),
+            "layout": json.dumps(names),
+        },
+    )
+
+
+def inventory_batch(
+    cat: catalog.Catalog, schema: pa.Schema, docs: List[dict]
+) -> pa.RecordBatch:
+    (owned, claimed, furn_qty, mat_qty) = catalog.inventory_matrices(cat, docs)
+
+    # Transposed, so every column is one contiguous row
+    columns = [
+        pa.array([doc["user_id"] for doc in docs], pa.string()),
+        pa.array([doc.get("revision", 0) for doc in docs], pa.int64()),
+    ]
+    for matrix, dtype in (
+        (owned, pa.bool_()),
+        (mat_qty.astype(np.int32), pa.int32()),
+        (furn_qty.astype(np.int32), pa.int32()),
+        (claimed, pa.bool_()),
+    ):
+        columns.extend(pa.array(column, dtype) for column in matrix.T.copy())
+
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def export_inventories(
+    db: pymongo.database.Database,
+    path: str,
+    batch_size: int = 1000,
+    cat: Optional[catalog.Catalog] = None,
+) -> int:
+    # One batch of users is held at a time, each written as its own row group
+    cat = cat or data.fetch_catalog(storage.MongoStorage(db))
+    schema = inventory_schema(cat)
+
+    users = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for docs in bulk.iter_inventory_batches(db.inventory, batch_size):
+            writer.write_batch(inventory_batch(cat, schema, docs))
+            users += len(docs)
+
+    return users
+
+
+def inventory_docs(names: dict, batch: pa.RecordBatch) -> Iterator[dict]:
+    # The inverse of inventory_batch, with every catalog entry present. Sets
+    # are listed if any of their characters was claimed.
+    def matrix(start: int, count: int) -> np.ndarray:
+        columns = [
+            batch.column(col).to_numpy(zero_copy_only=False)
+            for col in range(start, start + count)
+        ]
+        return np.column_stack(columns) if columns else np.zeros((batch.num_rows, 0))
+
+    sizes = [len(names[kind]) for kind in ("characters", "materials", "furnishings")]
+    starts = np.cumsum([2, *sizes]).tolist()
+    owned = matrix(starts[0], sizes[0]).tolist()
+    mat_qty = matrix(starts[1], sizes[1]).tolist()
+    furn_qty = matrix(starts[2], sizes[2]).tolist()
+    claimed = matrix(starts[3], len(names["pairs"]))
+
+    # The pairs of every set by position, and the set of every pair
+    set_pairs = {}
+    for pos, (name, char) in enumerate(names["pairs"]):
+        set_pairs.setdefault(name, []).append((char, pos))
+    set_names = list(set_pairs)
+    set_ids = {name: set_id for set_id, name in enumerate(set_names)}
+    pair_set = np.array([set_ids[name] for name, _ in names["pairs"]], dtype=np.intp)
+
+    user_ids = batch.column(0).to_pylist()
+    revisions = batch.column(1).to_pylist()
+    for row, user_id in enumerate(user_ids):
+        claims = claimed[row]
+        sets = [
+            {
+                "name": set_names[set_id],
+                "characters": {
+                    char: bool(claims[pos])
+                    for char, pos in set_pairs[set_names[set_id]]
+                },
+            }
+            for set_id in np.unique(pair_set[np.flatnonzero(claims)]).tolist()
+        ]
+        yield {
+            "user_id": user_id,
+            "revision": revisions[row],
+            "characters": dict(zip(names["characters"], map(bool, owned[row]))),
+            "materials": dict(zip(names["materials"], map(int, mat_qty[row]))),
+            "furnishings": dict(zip(names["furnishings"], map(int, furn_qty[row]))),
+            "sets": sets,
+        }
+
+
+def import_inventories(
+    db: pymongo.database.Database, path: str, batch_size: int = 1000
+) -> int:
+    # Overwrites the inventories of the users in the file. Their revision is
+    # moved on, so an open session saving over the restored one is refused.
+    file = pq.ParquetFile(path)
+    names = json.loads(file.schema_arrow.metadata[b"layout"])
+
+    users = 0
+    for batch in file.iter_batches(batch_size):
+        updates = []
+        for doc in inventory_docs(names, batch):
+            doc.pop("revision")
+            updates.append(
+                UpdateOne(
+                    {"user_id": doc["user_id"]},
+                    {"$set": doc, "$inc": {"revision": 1}},
+                    upsert=True,
+                )
+            )
+        if updates:
+            db.inventory.bulk_write(updates, ordered=False)
+        users += len(updates)
+
+    return users
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export every inventory to Parquet, or restore them from it"
+    )
+    parser.add_argument("--uri", help="MongoDB URI, defaults to the app's secrets")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--export", metavar="PATH", help="write the inventories")
+    action.add_argument("--restore", metavar="PATH", help="read them back")
+    args = parser.parse_args()
+    uri = args.uri or st.secrets["mongo"]["uri"]
+    db = MongoClient(uri, server_api=ServerApi("1")).furnishings
+
+    start = time.perf_counter()
+    if args.export:
+        users = export_inventories(db, args.export, args.batch_size)
+    else:
+        users = import_inventories(db, args.restore, args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"{users} users in {elapsed:.2f}s ({users / max(elapsed, 1e-9):.0f}/s)")
@@ -1,78 +1,384 @@
+import asyncio
 import json
+import random
+import threading
+import time
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+import metrics
+import writes
+
+DEFAULT_BASE_URL = "https://www.googleapis.com/identitytoolkit/v3/relyingparty"
+HEADERS = {"content-type": "application/json; charset=UTF-8"}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Calls that may have taken effect before failing, creating an account or
+# sending an email, are only retried when the request surely wasn't handled
+IDEMPOTENT_ENDPOINTS = {"verifyPassword", "getAccountInfo"}
+UNHANDLED_STATUSES = {429, 503}
+MAX_ATTEMPTS = 3
+
+# Count, errors and latency of the calls made to each endpoint
+auth_metrics = {}
+_metrics_lock = threading.Lock()
+_clients = {}
+# Async clients by the event loop they belong to, each with the generator
+# that closes it and drops it when the loop shuts down
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _config(name: str, default):
+    return st.secrets["firebase"].get(name, default)
+
+
+def _endpoint_url(endpoint: str) -> str:
+    # The base URL can point at a local stub of the identitytoolkit endpoints
+    return "{0}/{1}?key={2}".format(
+        _config("base_url", DEFAULT_BASE_URL).rstrip("/"),
+        endpoint,
+        st.secrets["firebase"]["api_key"],
+    )
+
+
+def _timeout() -> tuple:
+    return (_config("connect_timeout", 3.0), _config("read_timeout", 10.0))
+
+
+def _session() -> requests.Session:
+    # One keep-alive session per process, so calls reuse pooled connections
+    with _clients_lock:
+        if "sync" not in _clients:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_maxsize=32))
+            session.mount("http://", HTTPAdapter(pool_maxsize=32))
+            _clients["sync"] = session
+
+        return _clients["sync"]
+
+
+def _record(endpoint: str, started: float, failed: bool) -> None:
+    elapsed = time.perf_counter() - started
+    with _metrics_lock:
+        stats = auth_metrics.setdefault(
+            endpoint,
+            {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0},
+        )
+        stats["count"] += 1
+        stats["errors"] += failed
+        stats["total_seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    metrics.observe("http_request_seconds", elapsed, endpoint=endpoint)
+    if failed:
+        metrics.inc("http_request_errors_total", endpoint=endpoint)
+
+
+def _backoff(attempt: int, retry_after=None) -> float:
+    # Exponential backoff with full jitter, or the server's Retry-After
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), 5.0)
+        except ValueError:
+            pass
+
+    return random.uniform(0, 0.2 * 2**attempt)
+
+
+def _never_sent(error: requests.exceptions.RequestException) -> bool:
+    # requests raises ConnectionError for a connection dropped after the
+    # request was sent as well, only failing to connect means it never was
+    import urllib3
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, "reason", reason)
+
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+def _post(endpoint: str, payload: dict) -> dict:
+    idempotent = endpoint in IDEMPOTENT_ENDPOINTS
+    statuses = RETRY_STATUSES if idempotent else UNHANDLED_STATUSES
+
+    for attempt in range(MAX_ATTEMPTS):
+        started = time.perf_counter()
+        try:
+            request_object = _session().post(
+                _endpoint_url(endpoint),
+                headers=HEADERS,
+                data=json.dumps(payload),
+                timeout=_timeout(),
+            )
+        except requests.exceptions.RequestException as error:
+            _record(endpoint, started, True)
+            retry = _never_sent(error) or (
+                idempotent
+                and isinstance(
+                    error,
+                    (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+                )
+            )
+            if not retry or attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(_backoff(attempt))
+            continue
+
+        retry = request_object.status_code in statuses
+        _record(endpoint, started, not request_object.ok)
+        if retry and attempt < MAX_ATTEMPTS - 1:
+            time.sleep(_backoff(attempt, request_object.headers.get("Retry-After")))
+            continue
+
+        raise_detailed_error(request_object)
+        return request_object.json()
+
+
+async def _closing(loop: asyncio.AbstractEventLoop, client: "httpx.AsyncClient"):
+    # Left suspended until its loop shuts down. asyncio.run closes a loop's
+    # async generators before the loop, so the client is closed on its loop.
+    try:
+        yield
+    finally:
+        with _clients_lock:
+            _async_clients.pop(loop, None)
+        await client.aclose()
+
+
+async def _post_async(endpoint: str, payload: dict) -> dict:
+    # httpx is only needed by async callers. A client can only be used on the
+    # event loop it was made on, so every loop gets its own.
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        created = loop not in _async_clients
+        if created:
+            client = httpx.AsyncClient(
+                headers=HEADERS,
+                timeout=httpx.Timeout(_timeout()[1], connect=_timeout()[0]),
+                limits=httpx.Limits(max_connections=32),
+            )
+            _async_clients[loop] = (client, _closing(loop, client))
+        (client, closing) = _async_clients[loop]
+    if created:
+        await closing.__anext__()
+
+    if endpoint in IDEMPOTENT_ENDPOINTS:
+        (failures, statuses) = (
+            (httpx.ConnectError, httpx.TimeoutException),
+            RETRY_STATUSES,
+        )
+    else:
+        (failures, statuses) = (
+            (httpx.ConnectError, httpx.ConnectTimeout),
+            UNHANDLED_STATUSES,
+        )
+
+    for attempt in range(MAX_ATTEMPTS):
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                _endpoint_url(endpoint), content=json.dumps(payload)
+            )
+        except failures:
+            _record(endpoint, started, True)
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+            continue
+        except httpx.HTTPError:
+            _record(endpoint, started, True)
+            raise
+
+        retry = response.status_code in statuses
+        _record(endpoint, started, response.is_error)
+        if retry and attempt < MAX_ATTEMPTS - 1:
+            await asyncio.sleep(_backoff(attempt, response.headers.get("Retry-After")))
+            continue
+
+        # Raise the same error as the sync client so callers handle both alike
+        if response.is_error:
+            raise requests.exceptions.HTTPError(
+                httpx.HTTPStatusError(
+                    response.reason_phrase, request=response.request, response=response
+                ),
+                response.text,
+            )
+        return response.json()
 
 
 def sign_in_with_email_and_password(email, password):
-    request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/verifyPassword?key={0}".format(
-        st.secrets["firebase"]["api_key"]
+    return _post(
+        "verifyPassword",
+        {"email": email, "password": password, "returnSecureToken": True},
     )
-    headers = {"content-type": "application/json; charset=UTF-8"}
-    data = json.dumps({"email": email, "password": password, "returnSecureToken": True})
-    request_object = requests.post(request_ref, headers=headers, data=data)
-    raise_detailed_error(request_object)
-
-    return request_object.json()
 
 
 def get_account_info(id_token):
-    request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/getAccountInfo?key={0}".format(
-        st.secrets["firebase"]["api_key"]
+    return _post("getAccountInfo", {"idToken": id_token})
+
+
+def send_email_verification(id_token):
+    return _post(
+        "getOobConfirmationCode", {"requestType": "VERIFY_EMAIL", "idToken": id_token}
     )
-    headers = {"content-type": "application/json; charset=UTF-8"}
-    data = json.dumps({"idToken": id_token})
-    request_object = requests.post(request_ref, headers=headers, data=data)
-    raise_detailed_error(request_object)
 
-    return request_object.json()
+
+def send_password_reset_email(email):
+    return _post(
+        "getOobConfirmationCode", {"requestType": "PASSWORD_RESET", "email": email}
+    )
 
 
-def send_email_verification(id_token):
-    request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/getOobConfirmationCode?key={0}".format(
-        st.secrets["firebase"]["api_key"]
+def create_user_with_email_and_password(email, password):
+    return _post(
+        "signupNewUser",
+        {"email": email, "password": password, "returnSecureToken": True},
     )
-    headers = {"content-type": "application/json; charset=UTF-8"}
-    data = json.dumps({"requestType": "VERIFY_EMAIL", "idToken": id_token})
-    request_object = requests.post(request_ref, headers=headers, data=data)
-    raise_detailed_error(request_object)
 
-    return request_object.json()
 
+def delete_user_account(id_token):
+    return _post("deleteAccount", {"idToken": id_token})
 
-def send_password_reset_email(email):
-    request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/getOobConfirmationCode?key={0}".format(
-        st.secrets["firebase"]["api_key"]
+
+async def sign_in_with_email_and_password_async(email, password):
+    return await _post_async(
+        "verifyPassword",
+        {"email": email, "password": password, "returnSecureToken": True},
     )
-    headers = {"content-type": "application/json; charset=UTF-8"}
-    data = json.dumps({"requestType": "PASSWORD_RESET", "email": email})
-    request_object = requests.post(request_ref, headers=headers, data=data)
-    raise_detailed_error(request_object)
 
-    return request_object.json()
 
+async def get_account_info_async(id_token):
+    return await _post_async("getAccountInfo", {"idToken": id_token})
 
-def create_user_with_email_and_password(email, password):
-    request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/signupNewUser?key={0}".format(
-        st.secrets["firebase"]["api_key"]
+
+async def send_email_verification_async(id_token):
+    return await _post_async(
+        "getOobConfirmationCode", {"requestType": "VERIFY_EMAIL", "idToken": id_token}
     )
-    headers = {"content-type": "application/json; charset=UTF-8"}
-    data = json.dumps({"email": email, "password": password, "returnSecureToken": True})
-    request_object = requests.post(request_ref, headers=headers, data=data)
-    raise_detailed_error(request_object)
 
-    return request_object.json()
 
+async def send_password_reset_email_async(email):
+    return await _post_async(
+        "getOobConfirmationCode", {"requestType": "PASSWORD_RESET", "email": email}
+    )
 
-def delete_user_account(id_token):
-    request_ref = "https://www.googleapis.com/identitytoolkit/v3/relyingparty/deleteAccount?key={0}".format(
-        st.secrets["firebase"]["api_key"]
+
+async def create_user_with_email_and_password_async(email, password):
+    return await _post_async(
+        "signupNewUser",
+        {"email": email, "password": password, "returnSecureToken": True},
     )
-    headers = {"content-type": "application/json; charset=UTF-8"}
-    data = json.dumps({"idToken": id_token})
-    request_object = requests.post(request_ref, headers=headers, data=data)
-    raise_detailed_error(request_object)
 
-    return request_object.json()
+
+async def delete_user_account_async(id_token):
+    return await _post_async("deleteAccount", {"idToken": id_token})
+
+
+JWKS_URL = (
+    "https://www.googleapis.com/service_accounts/v1/jwk/"
+    "securetoken@system.gserviceaccount.com"
+)
+JWKS_TTL = 3600.0
+# An unknown key id forces a refetch at most this often, since anyone can
+# send a token with a made up one
+JWKS_MIN_REFETCH = 60.0
+
+_jwks = {"keys": None, "expires_at": 0.0, "fetched_at": 0.0, "fetching": False}
+_jwks_cond = threading.Condition()
+
+
+def _fetch_jwks() -> tuple:
+    # A fixture key set can stand in for Google's keys in offline tests
+    jwks_file = _config("jwks_file", None)
+    if jwks_file:
+        with open(jwks_file) as file:
+            return (json.load(file), float("inf"))
+
+    started = time.perf_counter()
+    response = _session().get(_config("jwks_url", JWKS_URL), timeout=_timeout())
+    _record("jwks", started, not response.ok)
+    response.raise_for_status()
+    ttl = JWKS_TTL
+    for directive in response.headers.get("Cache-Control", "").split(","):
+        if directive.strip().startswith("max-age="):
+            ttl = float(directive.strip()[len("max-age=") :])
+
+    return (response.json(), ttl)
+
+
+def _signing_keys(force: bool = False) -> "jwt.PyJWKSet":
+    import jwt
+
+    # One thread fetches at a time, outside the lock, and the others wait
+    # for its keys instead of fetching them again
+    with _jwks_cond:
+        while True:
+            fresh = _jwks["keys"] is not None and time.time() < _jwks["expires_at"]
+            recent = time.time() - _jwks["fetched_at"] < JWKS_MIN_REFETCH
+            if fresh and (not force or recent):
+                return _jwks["keys"]
+            if not _jwks["fetching"]:
+                break
+            _jwks_cond.wait()
+        _jwks["fetching"] = True
+
+    keys = None
+    try:
+        (source, ttl) = _fetch_jwks()
+        keys = jwt.PyJWKSet.from_dict(source)
+    finally:
+        with _jwks_cond:
+            if keys is not None:
+                now = time.time()
+                _jwks.update(keys=keys, expires_at=now + ttl, fetched_at=now)
+            _jwks["fetching"] = False
+            _jwks_cond.notify_all()
+
+    return keys
+
+
+def verify_id_token(id_token: str) -> dict:
+    import jwt
+
+    project_id = st.secrets["firebase"]["project_id"]
+    kid = jwt.get_unverified_header(id_token).get("kid")
+    try:
+        key = _signing_keys()[kid]
+    except KeyError:
+        # Google rotates its keys, so an unknown key id forces a refetch
+        key = _signing_keys(force=True)[kid]
+
+    claims = jwt.decode(
+        id_token,
+        key=key.key,
+        algorithms=["RS256"],
+        audience=project_id,
+        issuer=f"https://securetoken.google.com/{project_id}",
+        options={"require": ["exp", "iat", "sub"]},
+    )
+    if not claims["sub"]:
+        raise jwt.InvalidTokenError("Token has no subject")
+
+    return claims
+
+
+def account_info(id_token: str) -> dict:
+    # Without a project id the token can't be checked locally. Otherwise the
+    # info comes from the verified token's own claims, which are never older
+    # than the token, so there is nothing worth caching.
+    if "project_id" not in st.secrets["firebase"]:
+        return get_account_info(id_token)["users"][0]
+
+    claims = verify_id_token(id_token)
+
+    return {
+        "localId": claims["sub"],
+        "email": claims.get("email"),
+        "emailVerified": claims.get("email_verified", False),
+    }
 
 
 def raise_detailed_error(request_object):
@@ -85,10 +391,11 @@ def raise_detailed_error(request_object):
 def sign_in(email: str, password: str) -> None:
     try:
         # Attempt to sign in with email and password
-        id_token = sign_in_with_email_and_password(email, password)["idToken"]
+        response = sign_in_with_email_and_password(email, password)
+        id_token = response["idToken"]
 
-        # Get account information
-        user_info = get_account_info(id_token)["users"][0]
+        # Get account information, from the token itself when possible
+        user_info = account_info(id_token)
 
         # If email is not verified, send verification email and do not sign in
         if not user_info["emailVerified"]:
@@ -98,7 +405,7 @@ def sign_in(email: str, password: str) -> None:
         # Save user info to session state and rerun
         else:
             st.session_state.user_info = user_info
-            st.experimental_rerun()
+            st.rerun()
 
     except requests.exceptions.HTTPError as error:
         error_message = json.loads(error.args[1])["error"]["message"]
@@ -163,6 +470,9 @@ def reset_password(email: str) -> None:
 
 
 def sign_out() -> None:
+    if "user_info" in st.session_state:
+        # Saves still waiting are written before the session is cleared
+        writes.flush(st.session_state.user_info["localId"])
     st.session_state.clear()
     st.session_state.auth_success = "You have successfully signed out"
 
@@ -0,0 +1,194 @@
+from typing import Optional
+import argparse
+import http.server
+import json
+import random
+import threading
+import time
+import uuid
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# A local stand-in for the identitytoolkit endpoints auth.py calls, and for
+# Google's signing keys, for trying the app and the service without Firebase.
+# Accounts live in memory. A verification email is never sent, the account
+# is verified right away instead.
+
+KEY_ID = "stub"
+TOKEN_LIFETIME = 3600
+
+
+class StubError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class StubAccounts:
+    def __init__(self, project_id: str, error_rate: float = 0.0):
+        self.project_id = project_id
+        # Share of calls answered with a 503 before being handled
+        self.error_rate = error_rate
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.lock = threading.Lock()
+        self.users = {}
+
+    def jwks(self) -> dict:
+        key = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.key.public_key()))
+        return {"keys": [{**key, "kid": KEY_ID, "alg": "RS256", "use": "sig"}]}
+
+    def id_token(self, user: dict) -> str:
+        now = int(time.time())
+        claims = {
+            "iss": f"https://securetoken.google.com/{self.project_id}",
+            "aud": self.project_id,
+            "sub": user["localId"],
+            "iat": now,
+            "exp": now + TOKEN_LIFETIME,
+            "auth_time": now,
+            "email": user["email"],
+            "email_verified": user["emailVerified"],
+        }
+        return jwt.encode(claims, self.key, "RS256", headers={"kid": KEY_ID})
+
+    def _signed_in(self, user: dict) -> dict:
+        return {
+            "localId": user["localId"],
+            "email": user["email"],
+            "idToken": self.id_token(user),
+            "refreshToken": uuid.uuid4().hex,
+            "expiresIn": str(TOKEN_LIFETIME),
+        }
+
+    def _token_user(self, id_token: Optional[str]) -> dict:
+        try:
+            claims = jwt.decode(
+                id_token or "",
+                self.key.public_key(),
+                algorithms=["RS256"],
+                audience=self.project_id,
+            )
+        except jwt.PyJWTError:
+            raise StubError("INVALID_ID_TOKEN")
+        for user in self.users.values():
+            if user["localId"] == claims["sub"]:
+                return user
+        raise StubError("USER_NOT_FOUND")
+
+    def handle(self, endpoint: str, payload: dict) -> dict:
+        with self.lock:
+            email = payload.get("email")
+            if endpoint == "signupNewUser":
+                if not email:
+                    raise StubError("MISSING_EMAIL")
+                if len(payload.get("password") or "") < 6:
+                    raise StubError("WEAK_PASSWORD")
+                if email in self.users:
+                    raise StubError("EMAIL_EXISTS")
+                user = self.users[email] = {
+                    "localId": uuid.uuid4().hex[:28],
+                    "email": email,
+                    "password": payload["password"],
+                    "emailVerified": False,
+                }
+                return self._signed_in(user)
+
+            if endpoint == "verifyPassword":
+                if email not in self.users:
+                    raise StubError("EMAIL_NOT_FOUND")
+                if self.users[email]["password"] != payload.get("password"):
+                    raise StubError("INVALID_PASSWORD")
+                return self._signed_in(self.users[email])
+
+            if endpoint == "getAccountInfo":
+                user = self._token_user(payload.get("idToken"))
+                info = {key: value for key, value in user.items() if key != "password"}
+                return {"users": [info]}
+
+            if endpoint == "getOobConfirmationCode":
+                if payload.get("requestType") == "VERIFY_EMAIL":
+                    user = self._token_user(payload.get("idToken"))
+                    user["emailVerified"] = True
+                    return {"email": user["email"]}
+                if email not in self.users:
+                    raise StubError("EMAIL_NOT_FOUND")
+                return {"email": email}
+
+            if endpoint == "deleteAccount":
+                user = self._token_user(payload.get("idToken"))
+                del self.users[user["email"]]
+                return {}
+
+        raise StubError("UNKNOWN_ENDPOINT", 404)
+
+
+def _handler(accounts: StubAccounts):
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict) -> None:
+            encoded = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(encoded)))
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/jwks":
+                self._reply(404, {})
+                return
+            self._reply(200, accounts.jwks())
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if random.random() < accounts.error_rate:
+                self._reply(503, {"error": {"code": 503, "message": "UNAVAILABLE"}})
+                return
+
+            endpoint = self.path.split("?")[0].rsplit("/", 1)[-1]
+            try:
+                self._reply(200, accounts.handle(endpoint, payload))
+            except StubError as error:
+                body = {"error": {"code": error.status, "message": error.message}}
+                self._reply(error.status, body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve(
+    accounts: StubAccounts, port: int, host: str = "127.0.0.1"
+) -> http.server.ThreadingHTTPServer:
+    server = http.server.ThreadingHTTPServer((host, port), _handler(accounts))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Stand in for the Firebase auth endpoints on a local port"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--project-id", default="stub-project")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of calls failing"
+    )
+    parser.add_argument("--jwks-out", help="also write the signing keys here")
+    args = parser.parse_args()
+
+    accounts = StubAccounts(args.project_id, args.error_rate)
+    if args.jwks_out:
+        with open(args.jwks_out, "w") as file:
+            json.dump(accounts.jwks(), file)
+
+    server = serve(accounts, args.port, args.host)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,301 @@
+from typing import Callable, Dict, List, Optional
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import streamlit as st
+import streamlit.logger
+import catalog
+import data_controller as data
+import solver
+import storage
+import writes
+
+INVENTORY_KINDS = ("empty", "sparse", "full")
+
+
+def _timings(func: Callable[[], object], repeat: int) -> List[float]:
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def _peak_allocated(func: Callable[[], object]) -> int:
+    # A separate run, tracing slows everything down too much to time
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(
+    results: Dict[str, dict], name: str, func: Callable[[], object], repeat: int
+) -> None:
+    timings = _timings(func, repeat)
+    (p50, p99) = np.percentile(timings, [50, 99]) * 1e6
+    result = {
+        "p50_us": round(float(p50), 1),
+        "p99_us": round(float(p99), 1),
+        "per_s": round(len(timings) / sum(timings), 1),
+        "peak_kib": round(_peak_allocated(func) / 1024, 1),
+    }
+    results[name] = result
+    print(
+        f"{name:<44} p50 {p50:>10.1f}us  p99 {p99:>10.1f}us"
+        f"  {result['per_s']:>9.1f}/s  peak {result['peak_kib']:>9.1f}KiB"
+    )
+
+
+def scaled_sets(set_docs: List[dict], factor: int) -> List[dict]:
+    # Copies of every set under new names, sharing the characters, furnishings
+    # and materials, like a catalog that kept growing with new sets
+    return [
+        {**doc, "name": f"{doc['name']} #{copy}" if copy else doc["name"]}
+        for copy in range(factor)
+        for doc in set_docs
+    ]
+
+
+def synthetic_inventory(
+    cat: catalog.Catalog, user_id: str, kind: str, seed: int = 0
+) -> Optional[dict]:
+    # None for a user that has no inventory yet
+    if kind == "empty":
+        return None
+
+    rng = random.Random(seed)
+    share = 0.1 if kind == "sparse" else 1.0
+    sets = {}
+    for name, char in cat.pairs:
+        if rng.random() < share:
+            sets.setdefault(name, {})[char] = rng.random() < 0.5
+
+    return {
+        "user_id": user_id,
+        "revision": 0,
+        "characters": {char: rng.random() < share for char in cat.characters},
+        "materials": {
+            mat: rng.randrange(500) if rng.random() < share else 0
+            for mat in cat.materials
+        },
+        "furnishings": {
+            furn: rng.randrange(3) if rng.random() < share else 0
+            for furn in cat.furnishings
+        },
+        "sets": [{"name": name, "characters": chars} for name, chars in sets.items()],
+    }
+
+
+def _flip(frame, column: str) -> Callable[[], None]:
+    # Each call edits the next row, so every save has something to write
+    rows = iter(range(1 << 62))
+    flag = frame[column].dtype == bool
+
+    def edit():
+        row = next(rows) % len(frame)
+        value = frame.at[row, column]
+        frame.at[row, column] = not value if flag else value + 1
+
+    return edit
+
+
+def bench_data(
+    results: Dict[str, dict], set_docs: List[dict], scale: int, repeat: int
+) -> None:
+    # The app's data layer, with the embedded backend as the local database
+    with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+        source = os.path.join(directory, "sets.json")
+        with open(source, "w", encoding="utf-8") as file:
+            json.dump(scaled_sets(set_docs, scale), file)
+        store = storage.EmbeddedStorage(os.path.join(directory, "bench.db"), source)
+        data.init_storage = lambda: store
+
+        measure(results, f"{scale}x/load catalog", data.reload_catalog, repeat)
+        cat = data.load_catalog()
+
+        for kind in INVENTORY_KINDS:
+            user_id = f"{kind}-{scale}"
+            st.session_state.user_info = {"localId": user_id}
+            user_inventory = synthetic_inventory(cat, user_id, kind)
+            if user_inventory is not None:
+                store.insert_inventory(user_inventory)
+
+            def cold():
+                for key in ("inventory", "inventory_frames"):
+                    st.session_state.pop(key, None)
+                return data.get_data()
+
+            prefix = f"{scale}x/{kind}"
+            measure(results, f"{prefix}/get_data cold", cold, repeat)
+            measure(results, f"{prefix}/get_data warm", data.get_data, repeat)
+
+            (_, char_df, mat_df, furn_df, sets_df) = data.get_data()
+            for update, frame, column in (
+                (data.update_chars, char_df, "owned"),
+                (data.update_mats, mat_df, "quantity"),
+                (data.update_furns, furn_df, "quantity"),
+                (data.update_sets, sets_df, "claimed"),
+            ):
+                # Flushed every time, so the write is timed and not just queued
+                frame = frame.copy()
+                edit = _flip(frame, column)
+                measure(
+                    results,
+                    f"{prefix}/{update.__name__}",
+                    lambda: (edit(), update(store, frame), writes.flush(user_id)),
+                    repeat,
+                )
+
+            (_, char_df, mat_df, furn_df, sets_df) = data.get_data()
+            for requirements in (data.calculate_requirements, data.live_requirements):
+                measure(
+                    results,
+                    f"{prefix}/{requirements.__name__}",
+                    lambda: requirements(char_df, sets_df, furn_df, mat_df),
+                    repeat,
+                )
+            st.session_state.pop("requirements_state", None)
+
+
+def synthetic_material_recipes(
+    set_docs: List[dict], depth: int, seed: int = 0
+) -> Dict[str, List[dict]]:
+    # Chains every material through `depth` levels of made-up intermediates
+    rng = random.Random(seed)
+    names = sorted(
+        {
+            mat["name"]
+            for doc in set_docs
+            for furn in doc["materials"]
+            for mat in furn["recipe"]
+        }
+    )
+    recipes = {}
+    for name in names:
+        parent = name
+        for level in range(depth):
+            child = f"{name} ({level + 1})"
+            recipes[parent] = [
+                {"name": child, "quantity": rng.randint(1, 4)},
+                {"name": f"Raw {rng.randrange(8)}", "quantity": rng.randint(1, 3)},
+            ]
+            parent = child
+
+    return recipes
+
+
+def bench_planner(
+    results: Dict[str, dict],
+    set_docs: List[dict],
+    depth: int,
+    users: int,
+    repeat: int,
+) -> None:
+    cat = catalog.compile_catalog(
+        set_docs, material_recipes=synthetic_material_recipes(set_docs, depth)
+    )
+    rng = np.random.default_rng(0)
+    owned = rng.random((users, len(cat.characters))) < 0.5
+    claimed = rng.random((users, len(cat.pairs))) < 0.3
+    furn_qty = rng.integers(0, 3, (users, len(cat.furnishings)))
+    mat_qty = rng.integers(0, 200, (users, len(cat.materials)))
+
+    def plan(rows):
+        (_, _, _, mat_needed) = catalog.compute_shortfalls(
+            cat, owned[rows], claimed[rows], furn_qty[rows], mat_qty[rows]
+        )
+        return catalog.expand_materials(cat, mat_needed, mat_qty[rows])
+
+    prefix = f"planner/{len(cat.material_levels)} levels"
+    measure(results, f"{prefix}/one user", lambda: plan(0), repeat)
+    measure(
+        results,
+        f"{prefix}/{users} users",
+        lambda: plan(slice(None)),
+        max(repeat // 10, 5),
+    )
+
+
+def bench_solver(results: Dict[str, dict], set_docs: List[dict], repeat: int) -> None:
+    # Everyone owned and nothing claimed, so all sets compete for the stock
+    cat = catalog.compile_catalog(set_docs)
+    owned = np.ones(len(cat.characters), dtype=bool)
+    claimed = np.zeros(len(cat.pairs), dtype=bool)
+    furn_qty = np.zeros(len(cat.furnishings), dtype=np.int64)
+
+    for stock in (20, 100, 500):
+        mat_qty = np.full(len(cat.materials), stock)
+        measure(
+            results,
+            f"claim order/{stock} of each",
+            lambda: solver.plan_claims(cat, owned, claimed, furn_qty, mat_qty),
+            repeat,
+        )
+
+
+def regressions(
+    results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float
+) -> List[str]:
+    return [
+        f"{name}: p50 {result['p50_us']}us, baseline {baseline[name]['p50_us']}us"
+        for name, result in results.items()
+        if name in baseline
+        and result["p50_us"] > baseline[name]["p50_us"] * (1 + tolerance)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the data layer, requirements and planners"
+    )
+    parser.add_argument("--source", default="sets.json")
+    parser.add_argument(
+        "--scales", type=int, nargs="+", default=[1, 10, 100], help="catalog sizes"
+    )
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument(
+        "--save", action="store_true", help="store the results as the baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.5, help="allowed p50 slowdown"
+    )
+    args = parser.parse_args()
+
+    # Streamlit warns about running without `streamlit run` on every call
+    streamlit.logger.set_log_level(logging.ERROR)
+    with open(args.source, encoding="utf-8") as file:
+        set_docs = json.load(file)
+
+    results = {}
+    for scale in args.scales:
+        bench_data(results, set_docs, scale, args.repeat)
+    for depth in (0, 2, 5):
+        bench_planner(results, set_docs, depth, args.users, args.repeat)
+    bench_solver(results, set_docs, max(args.repeat // 10, 3))
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    elif not os.path.exists(args.baseline):
+        # Nothing to compare against is a failed check, not a passed one
+        raise SystemExit(f"No baseline at {args.baseline}; store one with --save first")
+    else:
+        with open(args.baseline, encoding="utf-8") as file:
+            failed = regressions(results, json.load(file), args.tolerance)
+        for line in failed:
+            print(f"REGRESSION: {line}")
+        raise SystemExit(1 if failed else 0)
@@ -0,0 +1,213 @@
+from typing import Iterator, List, Optional, Tuple
+import argparse
+import multiprocessing
+import re
+import time
+import streamlit as st
+import pymongo.collection
+import pymongo.database
+from pymongo.server_api import ServerApi
+from pymongo.mongo_client import MongoClient
+import catalog
+import catalog_file
+import schema
+import snapshots
+import storage
+import data_controller as data
+
+
+def iter_inventory_batches(
+    inventory: pymongo.collection.Collection,
+    batch_size: int = 1000,
+    query: Optional[dict] = None,
+    sort: bool = False,
+) -> Iterator[List[dict]]:
+    cursor = inventory.find(
+        query or {}, {"_id": 0, **schema.INVENTORY_FIELDS}, batch_size=batch_size
+    )
+    if sort:
+        cursor = cursor.sort("user_id")
+
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(
+    db: pymongo.database.Database,
+    batch_size: int = 1000,
+    query: Optional[dict] = None,
+    cat: Optional[catalog.Catalog] = None,
+) -> int:
+    store = storage.MongoStorage(db)
+    cat = cat or data.fetch_catalog(store)
+
+    users = 0
+    for docs in iter_inventory_batches(db.inventory, batch_size, query):
+        store.save_requirements(snapshots.compute_batch(cat, docs))
+        users += len(docs)
+
+    return users
+
+
+# Compiled once in the parent and inherited by the forked shard workers
+_shared_catalog: Optional[catalog.Catalog] = None
+
+
+def clear_job(db: pymongo.database.Database, job_id: str) -> None:
+    # The job's shard bounds and every shard's checkpoint
+    db.jobs.delete_many({"_id": {"$regex": f"^{re.escape(job_id)}(:|$)"}})
+
+
+def plan_shards(
+    db: pymongo.database.Database, job_id: str, shards: int, restart: bool = False
+) -> List[Tuple[Optional[str], Optional[str]]]:
+    if restart:
+        clear_job(db, job_id)
+
+    # Shard bounds are stored with the job so a resumed run splits the same way
+    job = db.jobs.find_one({"_id": job_id})
+    if job is None:
+        users = db.inventory.count_documents({})
+        bounds = []
+        for shard in range(1, shards):
+            cursor = (
+                db.inventory.find({}, {"user_id": 1, "_id": 0})
+                .sort("user_id")
+                .skip(shard * users // shards)
+                .limit(1)
+            )
+            bounds.extend(doc["user_id"] for doc in cursor)
+        job = {"_id": job_id, "bounds": sorted(set(bounds))}
+        db.jobs.insert_one(job)
+
+    edges = [None, *job["bounds"], None]
+    return list(zip(edges, edges[1:]))
+
+
+def _run_shard(
+    uri: str,
+    job_id: str,
+    shard: int,
+    lower: Optional[str],
+    upper: Optional[str],
+    batch_size: int,
+) -> int:
+    # Every worker needs its own client, pymongo clients are not fork-safe
+    client = MongoClient(uri, server_api=ServerApi("1"))
+    db = client.furnishings
+    store = storage.MongoStorage(db)
+    cat = _shared_catalog or data.fetch_catalog(store)
+
+    checkpoint_id = f"{job_id}:{shard}"
+    checkpoint = db.jobs.find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get("done"):
+        client.close()
+        return 0
+
+    # Resume right after the last user the shard finished
+    user_range = {}
+    if lower is not None:
+        user_range["$gte"] = lower
+    if upper is not None:
+        user_range["$lt"] = upper
+    if checkpoint.get("last_user_id") is not None:
+        user_range["$gt"] = checkpoint["last_user_id"]
+    query = {"user_id": user_range} if user_range else {}
+
+    users = 0
+    for docs in iter_inventory_batches(db.inventory, batch_size, query, sort=True):
+        store.save_requirements(snapshots.compute_batch(cat, docs))
+        db.jobs.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_user_id": docs[-1]["user_id"]}},
+            upsert=True,
+        )
+        users += len(docs)
+
+    db.jobs.update_one({"_id": checkpoint_id}, {"$set": {"done": True}}, upsert=True)
+    client.close()
+
+    return users
+
+
+def run_sharded(
+    uri: str,
+    shards: int,
+    batch_size: int = 1000,
+    job_id: str = "requirements",
+    restart: bool = False,
+    catalog_path: Optional[str] = None,
+) -> int:
+    global _shared_catalog
+
+    client = MongoClient(uri, server_api=ServerApi("1"))
+    if catalog_path:
+        _shared_catalog = catalog_file.load_catalog_file(catalog_path)
+    else:
+        _shared_catalog = data.fetch_catalog(storage.MongoStorage(client.furnishings))
+    ranges = plan_shards(client.furnishings, job_id, shards, restart)
+    if client.furnishings.jobs.count_documents(
+        {"_id": {"$regex": f"^{re.escape(job_id)}:"}}
+    ):
+        print(f"Resuming job {job_id} from its checkpoints")
+    client.close()
+
+    with multiprocessing.get_context("fork").Pool(len(ranges)) as pool:
+        users = pool.starmap(
+            _run_shard,
+            [
+                (uri, job_id, shard, lower, upper, batch_size)
+                for shard, (lower, upper) in enumerate(ranges)
+            ],
+        )
+
+    # Every shard finished, so the next run of the job starts over. A job
+    # that was killed keeps its checkpoints and resumes instead.
+    client = MongoClient(uri, server_api=ServerApi("1"))
+    clear_job(client.furnishings, job_id)
+    client.close()
+
+    return sum(users)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute gift set requirements for every stored inventory"
+    )
+    parser.add_argument("--uri", help="MongoDB URI, defaults to the app's secrets")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--shards", type=int, default=1, help="worker processes")
+    parser.add_argument("--job-id", default="requirements", help="checkpoint name")
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the job's checkpoints"
+    )
+    parser.add_argument(
+        "--catalog-file", help="compiled catalog to use instead of the database's"
+    )
+    args = parser.parse_args()
+    uri = args.uri or st.secrets["mongo"]["uri"]
+
+    start = time.perf_counter()
+    if args.shards > 1:
+        users = run_sharded(
+            uri,
+            args.shards,
+            args.batch_size,
+            args.job_id,
+            args.restart,
+            args.catalog_file,
+        )
+    else:
+        client = MongoClient(uri, server_api=ServerApi("1"))
+        cat = None
+        if args.catalog_file:
+            cat = catalog_file.load_catalog_file(args.catalog_file)
+        users = run(client.furnishings, args.batch_size, cat=cat)
+    elapsed = time.perf_counter() - start
+    print(f"{users} users in {elapsed:.2f}s ({users / max(elapsed, 1e-9):.0f}/s)")
@@ -0,0 +1,634 @@
+from functools import cached_property
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd
+
+
+class ReverseIndex(NamedTuple):
+    # The ids related to id i are ids[offsets[i]:offsets[i + 1]], ascending
+    offsets: np.ndarray
+    ids: np.ndarray
+
+    def of(self, item: int) -> np.ndarray:
+        return self.ids[self.offsets[item] : self.offsets[item + 1]]
+
+
+class SparseRows(NamedTuple):
+    # Row i has values[offsets[i]:offsets[i + 1]] in the columns
+    # cols[offsets[i]:offsets[i + 1]], ascending
+    offsets: np.ndarray
+    cols: np.ndarray
+    values: np.ndarray
+
+    def dense(self, columns: int) -> np.ndarray:
+        rows = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        matrix = np.zeros((len(self.offsets) - 1, columns), dtype=np.int64)
+        matrix[rows, self.cols] = self.values
+
+        return matrix
+
+
+class _CatalogFields(NamedTuple):
+    version: int
+    set_names: pd.Index
+    characters: pd.Index
+    furnishings: pd.Index
+    materials: pd.Index
+    # (set, character) pairs, sorted by set name like the Sets tab
+    pairs: pd.MultiIndex
+    pair_set: np.ndarray
+    pair_char: np.ndarray
+    # Max amount of each furnishing required by each set
+    set_furnishings: SparseRows
+    # Quantity of each material needed to craft one furnishing
+    furnishing_recipes: SparseRows
+    # Quantity of each material needed to craft one material, for
+    # intermediates like Fabric, and the materials grouped so every level
+    # only feeds the levels after it
+    material_parts: SparseRows
+    material_levels: Tuple[np.ndarray, ...]
+    # Name -> id lookups per kind ("sets", "characters", "furnishings", ...)
+    ids: Mapping[str, Mapping[str, int]]
+    # Sets each character is in, sets needing each furnishing and
+    # furnishings crafted from each material
+    character_sets: ReverseIndex
+    furnishing_sets: ReverseIndex
+    material_furnishings: ReverseIndex
+
+
+class Catalog(_CatalogFields):
+    # The fields hold compact arrays only. The dense matrices the
+    # computations index are built from them on first use.
+
+    @cached_property
+    def pair_ids(self) -> np.ndarray:
+        # Pair id of each (set, character), or -1 when the character isn't in
+        # the set
+        pair_ids = np.full((len(self.set_names), len(self.characters)), -1, np.intp)
+        pair_ids[self.pair_set, self.pair_char] = np.arange(len(self.pair_set))
+
+        return _frozen(pair_ids)
+
+    @cached_property
+    def pair_columns(self) -> List[pd.Index]:
+        # The set and character of every pair, like the Sets tab's columns
+        return [self.pairs.get_level_values(0), self.pairs.get_level_values(1)]
+
+    @cached_property
+    def set_amounts(self) -> np.ndarray:
+        # Sets (rows) by furnishings (columns)
+        return _frozen(self.set_furnishings.dense(len(self.furnishings)))
+
+    @cached_property
+    def recipes(self) -> np.ndarray:
+        # Furnishings (rows) by materials (columns)
+        return _frozen(self.furnishing_recipes.dense(len(self.materials)))
+
+    @cached_property
+    def craftable(self) -> np.ndarray:
+        return _frozen(np.diff(self.furnishing_recipes.offsets) > 0)
+
+    @cached_property
+    def material_recipes(self) -> np.ndarray:
+        # Materials (rows) by their input materials (columns)
+        return _frozen(self.material_parts.dense(len(self.materials)))
+
+    @cached_property
+    def craftable_materials(self) -> np.ndarray:
+        return _frozen(np.diff(self.material_parts.offsets) > 0)
+
+
+def _frozen(array: np.ndarray) -> np.ndarray:
+    array.setflags(write=False)
+    return array
+
+
+def _intern(names: Iterable[str]) -> Dict[str, int]:
+    ids: Dict[str, int] = {}
+    for name in names:
+        ids.setdefault(name, len(ids))
+
+    return ids
+
+
+def compile_catalog(
+    set_docs: Iterable[dict],
+    character_names: Iterable[str] = (),
+    material_names: Iterable[str] = (),
+    furnishing_names: Iterable[str] = (),
+    version: int = 0,
+    material_recipes: Optional[Mapping[str, List[dict]]] = None,
+) -> Catalog:
+    set_docs = sorted(set_docs, key=lambda doc: doc["name"])
+    material_recipes = material_recipes or {}
+
+    # Listed names keep their collection order, extras from the sets follow
+    characters = _intern(character_names)
+    furnishings = _intern(furnishing_names)
+    materials = _intern(material_names)
+    recipes: Dict[str, List[dict]] = {}
+
+    # Intern every name into an integer id, in order of first appearance
+    for doc in set_docs:
+        for char in doc.get("characters", []):
+            characters.setdefault(char, len(characters))
+        for furn in doc.get("materials", []):
+            furnishings.setdefault(furn["name"], len(furnishings))
+            recipes.setdefault(furn["name"], furn["recipe"])
+            for mat in furn["recipe"]:
+                materials.setdefault(mat["name"], len(materials))
+    for mat, recipe in material_recipes.items():
+        materials.setdefault(mat, len(materials))
+        for part in recipe:
+            materials.setdefault(part["name"], len(materials))
+
+    set_amounts = np.zeros((len(set_docs), len(furnishings)), dtype=np.int64)
+    pair_set, pair_char = [], []
+    for set_idx, doc in enumerate(set_docs):
+        for char in doc.get("characters", []):
+            pair_set.append(set_idx)
+            pair_char.append(characters[char])
+        for furn in doc.get("materials", []):
+            col = furnishings[furn["name"]]
+            set_amounts[set_idx, col] = max(set_amounts[set_idx, col], furn["amount"])
+
+    recipe_matrix = np.zeros((len(furnishings), len(materials)), dtype=np.int64)
+    for furn, recipe in recipes.items():
+        for mat in recipe:
+            recipe_matrix[furnishings[furn], materials[mat["name"]]] += mat["quantity"]
+
+    sub_recipes = np.zeros((len(materials), len(materials)), dtype=np.int64)
+    for mat, recipe in material_recipes.items():
+        for part in recipe:
+            sub_recipes[materials[mat], materials[part["name"]]] += part["quantity"]
+
+    return assemble_catalog(
+        version,
+        [doc["name"] for doc in set_docs],
+        list(characters),
+        list(furnishings),
+        list(materials),
+        np.array(pair_set, dtype=np.intp),
+        np.array(pair_char, dtype=np.intp),
+        set_amounts,
+        recipe_matrix,
+        sub_recipes,
+    )
+
+
+def _levels(recipes: np.ndarray) -> Tuple[np.ndarray, ...]:
+    # Kahn's algorithm, a material is levelled once everything using it is
+    users = np.count_nonzero(recipes, axis=0)
+    level = np.flatnonzero(users == 0)
+    levels = []
+    while len(level):
+        levels.append(_frozen(level))
+        users = users - np.count_nonzero(recipes[level], axis=0)
+        users[np.concatenate(levels)] = -1
+        level = np.flatnonzero(users == 0)
+
+    if sum(map(len, levels)) < len(recipes):
+        raise ValueError("Material recipes form a cycle")
+
+    return tuple(levels)
+
+
+def _compact(values: np.ndarray) -> np.ndarray:
+    # Ids and amounts are stored as uint16 when they fit, int32 otherwise
+    values = np.asarray(values)
+    if not len(values) or (values.min() >= 0 and values.max() <= 0xFFFF):
+        return values.astype(np.uint16)
+
+    return values.astype(np.int32)
+
+
+def _offsets(counts: np.ndarray) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+
+
+def _reverse(rows: np.ndarray, cols: np.ndarray, count: int) -> ReverseIndex:
+    # Groups the rows by column, for each of `count` columns
+    order = np.argsort(cols, kind="stable")
+
+    return ReverseIndex(
+        _frozen(_offsets(np.bincount(cols, minlength=count))),
+        _frozen(_compact(rows[order])),
+    )
+
+
+def _sparse(matrix: np.ndarray) -> SparseRows:
+    (rows, cols) = np.nonzero(matrix)
+
+    return SparseRows(
+        _frozen(_offsets(np.bincount(rows, minlength=len(matrix)))),
+        _frozen(_compact(cols)),
+        _frozen(_compact(matrix[rows, cols])),
+    )
+
+
+# The array fields of a catalog, stored as they are by compiled catalog files,
+# and the fields made of several arrays
+ARRAY_FIELDS = ("pair_set", "pair_char")
+COMPOUND_FIELDS = {
+    "set_furnishings": SparseRows,
+    "furnishing_recipes": SparseRows,
+    "material_parts": SparseRows,
+    "character_sets": ReverseIndex,
+    "furnishing_sets": ReverseIndex,
+    "material_furnishings": ReverseIndex,
+}
+# The dense matrices a catalog derives from its compact fields
+DENSE_FIELDS = ("set_amounts", "recipes", "material_recipes")
+
+
+def assemble_catalog(
+    version: int,
+    set_names: List[str],
+    characters: List[str],
+    furnishings: List[str],
+    materials: List[str],
+    pair_set: np.ndarray,
+    pair_char: np.ndarray,
+    set_amounts: np.ndarray,
+    recipes: np.ndarray,
+    material_recipes: np.ndarray,
+) -> Catalog:
+    # Derives the compact fields every catalog needs from its names, which
+    # are unique and in id order, its id arrays and its dense matrices
+    arrays = {
+        "pair_set": _compact(pair_set),
+        "pair_char": _compact(pair_char),
+        "set_furnishings": _sparse(set_amounts),
+        "furnishing_recipes": _sparse(recipes),
+        "material_parts": _sparse(material_recipes),
+        "material_levels": tuple(map(_compact, _levels(material_recipes))),
+        "character_sets": _reverse(pair_set, pair_char, len(characters)),
+        "furnishing_sets": _reverse(*np.nonzero(set_amounts), len(furnishings)),
+        "material_furnishings": _reverse(*np.nonzero(recipes), len(materials)),
+    }
+    cat = catalog_from_arrays(
+        version, set_names, characters, furnishings, materials, arrays
+    )
+
+    # The matrices are at hand already, so they aren't rebuilt on first use
+    for field, matrix in zip(DENSE_FIELDS, (set_amounts, recipes, material_recipes)):
+        vars(cat)[field] = _frozen(matrix)
+
+    return cat
+
+
+def catalog_from_arrays(
+    version: int,
+    set_names: List[str],
+    characters: List[str],
+    furnishings: List[str],
+    materials: List[str],
+    arrays: Mapping[str, object],
+    indexes: Optional[Sequence[pd.Index]] = None,
+) -> Catalog:
+    # Wraps compact arrays derived already, like read-only views of a mapped
+    # file, without copying them. Only the name lookups are built, and only
+    # the indexes of the names that weren't given.
+    names = (set_names, characters, furnishings, materials)
+    (set_index, char_index, furn_index, mat_index) = indexes or map(pd.Index, names)
+    ids = {
+        kind: MappingProxyType(dict(zip(kind_names, range(len(kind_names)))))
+        for kind, kind_names in zip(
+            ("sets", "characters", "furnishings", "materials"), names
+        )
+    }
+
+    return Catalog(
+        version=version,
+        set_names=set_index,
+        characters=char_index,
+        furnishings=furn_index,
+        materials=mat_index,
+        pairs=pd.MultiIndex(
+            levels=[set_index, char_index],
+            codes=[arrays["pair_set"], arrays["pair_char"]],
+            names=["name", "characters"],
+            verify_integrity=False,
+        ),
+        **{field: _frozen(arrays[field]) for field in ARRAY_FIELDS},
+        **{
+            field: kind(*map(_frozen, arrays[field]))
+            for field, kind in COMPOUND_FIELDS.items()
+        },
+        material_levels=tuple(map(_frozen, arrays["material_levels"])),
+        ids=MappingProxyType(ids),
+    )
+
+
+def material_sets(catalog: Catalog, material: int) -> np.ndarray:
+    # Sets needing any furnishing crafted from the material
+    furnishings = catalog.material_furnishings.of(material)
+    sets = [catalog.furnishing_sets.of(furn) for furn in furnishings.tolist()]
+
+    return np.unique(np.concatenate(sets)) if sets else np.zeros(0, np.intp)
+
+
+def _in_order(frame: pd.DataFrame, keys: List[str], columns: List[pd.Index]) -> bool:
+    # Compares the arrays whole, which for Arrow-backed names is a buffer
+    # comparison instead of one per name
+    if len(frame) != len(columns[0]):
+        return False
+
+    return all(
+        frame[key].array.equals(column.array) for key, column in zip(keys, columns)
+    )
+
+
+def _align(
+    frame: pd.DataFrame,
+    keys: List[str],
+    column: str,
+    index: pd.Index,
+    columns: List[pd.Index],
+    fill,
+    dtype,
+) -> np.ndarray:
+    # Frames built from the catalog are usually already in catalog order, and
+    # their values of the right dtype without gaps
+    if _in_order(frame, keys, columns):
+        values = frame[column]
+        if values.dtype == dtype:
+            return values.to_numpy()
+    else:
+        values = frame.set_index(keys)[column].reindex(index, fill_value=fill)
+
+    return values.to_numpy(dtype=dtype, na_value=fill)
+
+
+def inventory_vectors(
+    catalog: Catalog,
+    char_df: pd.DataFrame,
+    sets_df: pd.DataFrame,
+    furn_df: pd.DataFrame,
+    mat_df: pd.DataFrame,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Align the edited frames to the catalog's integer ids
+    owned = _align(
+        char_df,
+        ["character_name"],
+        "owned",
+        catalog.characters,
+        [catalog.characters],
+        False,
+        bool,
+    )
+    claimed = _align(
+        sets_df,
+        ["name", "characters"],
+        "claimed",
+        catalog.pairs,
+        catalog.pair_columns,
+        False,
+        bool,
+    )
+    furn_qty = _align(
+        furn_df,
+        ["name"],
+        "quantity",
+        catalog.furnishings,
+        [catalog.furnishings],
+        0,
+        np.int64,
+    )
+    mat_qty = _align(
+        mat_df,
+        ["name"],
+        "quantity",
+        catalog.materials,
+        [catalog.materials],
+        0,
+        np.int64,
+    )
+
+    return (owned, claimed, furn_qty, mat_qty)
+
+
+def _lookup(ids: Mapping[str, int], keys: list) -> np.ndarray:
+    return np.array([ids.get(key, -1) for key in keys], dtype=np.intp)
+
+
+def _scatter(
+    cols: np.ndarray, rows: List[int], values: list, shape, dtype
+) -> np.ndarray:
+    # Drop the keys that aren't in the catalog
+    matrix = np.zeros(shape, dtype=dtype)
+    known = cols >= 0
+    values = np.nan_to_num(np.array(values, dtype=float)[known])
+    matrix[np.array(rows, dtype=np.intp)[known], cols[known]] = values
+
+    return matrix
+
+
+def inventory_matrices(
+    catalog: Catalog, docs: List[dict]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # One row per inventory document, one column per catalog id
+    matrices = []
+    for field, dtype in (
+        ("characters", bool),
+        ("furnishings", np.int64),
+        ("materials", np.int64),
+    ):
+        names = list(catalog.ids[field])
+        matrix = np.zeros((len(docs), len(names)), dtype=dtype)
+
+        # Documents written from this catalog store their keys in catalog order
+        in_order, in_order_values = [], []
+        rows, keys, values = [], [], []
+        for row, doc in enumerate(docs):
+            stored = doc[field]
+            if len(stored) == len(names) and list(stored) == names:
+                in_order.append(row)
+                in_order_values.append(list(stored.values()))
+            else:
+                rows.extend([row] * len(stored))
+                keys.extend(stored)
+                values.extend(stored.values())
+
+        if in_order:
+            matrix[in_order] = np.nan_to_num(np.array(in_order_values, dtype=float))
+        if rows:
+            cols = _lookup(catalog.ids[field], keys)
+            matrix += _scatter(cols, rows, values, matrix.shape, dtype)
+        matrices.append(matrix)
+
+    # Only claimed pairs need looking up, by set and character id
+    set_ids, char_ids = catalog.ids["sets"], catalog.ids["characters"]
+    rows, pair_sets, pair_chars = [], [], []
+    for row, doc in enumerate(docs):
+        for stored in doc["sets"]:
+            set_id = set_ids.get(stored["name"], -1)
+            for char, value in stored["characters"].items():
+                if value and set_id >= 0 and char in char_ids:
+                    rows.append(row)
+                    pair_sets.append(set_id)
+                    pair_chars.append(char_ids[char])
+    cols = catalog.pair_ids[pair_sets, pair_chars] if rows else np.zeros(0, np.intp)
+    claimed = _scatter(
+        cols, rows, [True] * len(rows), (len(docs), len(catalog.pairs)), bool
+    )
+
+    (owned, furn_qty, mat_qty) = matrices
+    return (owned, claimed, furn_qty, mat_qty)
+
+
+def compute_shortfalls(
+    catalog: Catalog,
+    owned: np.ndarray,
+    claimed: np.ndarray,
+    furn_qty: np.ndarray,
+    mat_qty: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Takes one inventory as vectors, or a batch of them as one row per user
+    if owned.ndim == 1:
+        batch = compute_shortfalls(
+            catalog, owned[None], claimed[None], furn_qty[None], mat_qty[None]
+        )
+        return tuple(result[0] for result in batch)
+
+    # A set is pending if any owned character has not claimed it yet
+    open_pairs = ~claimed & owned[:, catalog.pair_char]
+    pending = np.zeros((len(owned), len(catalog.set_names)), dtype=bool)
+    rows, pairs = np.nonzero(open_pairs)
+    pending[rows, catalog.pair_set[pairs]] = True
+
+    # Shared furnishings only need the largest amount any pending set asks for
+    if len(pending) == 1:
+        needed = catalog.set_amounts[pending[0]].max(axis=0, initial=0)[None]
+    else:
+        needed = np.zeros((len(pending), len(catalog.furnishings)), dtype=np.int64)
+        for set_idx in np.flatnonzero(pending.any(axis=0)):
+            cols = np.flatnonzero(catalog.set_amounts[set_idx])
+            amounts = pending[:, set_idx, None] * catalog.set_amounts[set_idx, cols]
+            needed[:, cols] = np.maximum(needed[:, cols], amounts)
+    furn_short = np.maximum(needed - furn_qty, 0)
+
+    craft_short = np.where(catalog.craftable, furn_short, 0)
+    buy_short = furn_short - craft_short
+    mat_needed = craft_short @ catalog.recipes
+
+    return (pending, buy_short, craft_short, mat_needed)
+
+
+def expand_materials(
+    catalog: Catalog, mat_needed: np.ndarray, mat_qty: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Nets each level against stock before expanding what is still short into
+    # its inputs, so an intermediate shared by many recipes is netted once.
+    # Works on one inventory or a batch, like compute_shortfalls.
+    needed = np.array(mat_needed, dtype=np.int64)
+    if len(catalog.material_levels) < 2:
+        return (needed, np.maximum(needed - mat_qty, 0))
+
+    short = np.zeros_like(needed)
+    for level in catalog.material_levels:
+        short[..., level] = np.maximum(needed[..., level] - mat_qty[..., level], 0)
+
+        # Only the crafted materials of the level feed anything, and only
+        # into their own inputs
+        crafted = level[catalog.craftable_materials[level]]
+        recipes = catalog.material_recipes[crafted]
+        cols = np.flatnonzero(recipes.any(axis=0))
+        if len(cols):
+            needed[..., cols] += short[..., crafted] @ recipes[:, cols]
+
+    return (needed, short)
+
+
+class RequirementsState(NamedTuple):
+    # Inputs the state was last brought up to date with
+    owned: np.ndarray
+    claimed: np.ndarray
+    furn_qty: np.ndarray
+    mat_qty: np.ndarray
+    # Open (owned and unclaimed) pairs per set, a set is pending while above 0
+    open_count: np.ndarray
+    pending: np.ndarray
+    needed: np.ndarray
+    buy_short: np.ndarray
+    craft_short: np.ndarray
+    # Sum of craft_short[f] * recipes[f] over every furnishing f
+    mat_needed: np.ndarray
+
+
+def start_requirements(
+    catalog: Catalog,
+    owned: np.ndarray,
+    claimed: np.ndarray,
+    furn_qty: np.ndarray,
+    mat_qty: np.ndarray,
+) -> RequirementsState:
+    open_pairs = ~claimed & owned[catalog.pair_char]
+    open_count = np.bincount(
+        catalog.pair_set[open_pairs], minlength=len(catalog.set_names)
+    )
+    pending = open_count > 0
+    needed = catalog.set_amounts[pending].max(axis=0, initial=0)
+    furn_short = np.maximum(needed - furn_qty, 0)
+    craft_short = np.where(catalog.craftable, furn_short, 0)
+
+    return RequirementsState(
+        owned=owned.copy(),
+        claimed=claimed.copy(),
+        furn_qty=furn_qty.copy(),
+        mat_qty=mat_qty.copy(),
+        open_count=open_count,
+        pending=pending,
+        needed=needed,
+        buy_short=furn_short - craft_short,
+        craft_short=craft_short,
+        mat_needed=craft_short @ catalog.recipes,
+    )
+
+
+def update_requirements(
+    catalog: Catalog,
+    state: RequirementsState,
+    owned: np.ndarray,
+    claimed: np.ndarray,
+    furn_qty: np.ndarray,
+    mat_qty: np.ndarray,
+) -> np.ndarray:
+    # Only the pairs whose character or claim changed can open or close a set
+    changed_chars = owned != state.owned
+    changed_pairs = np.flatnonzero(
+        (claimed != state.claimed) | changed_chars[catalog.pair_char]
+    )
+    was_open = (
+        ~state.claimed[changed_pairs] & state.owned[catalog.pair_char[changed_pairs]]
+    )
+    is_open = ~claimed[changed_pairs] & owned[catalog.pair_char[changed_pairs]]
+    np.add.at(
+        state.open_count,
+        catalog.pair_set[changed_pairs],
+        is_open.astype(np.int64) - was_open,
+    )
+    flipped = np.flatnonzero((state.open_count > 0) != state.pending)
+    state.pending[flipped] = ~state.pending[flipped]
+
+    # Furnishings of the flipped sets, plus the ones whose stock changed
+    affected = catalog.set_amounts[flipped].any(axis=0) | (furn_qty != state.furn_qty)
+    cols = np.flatnonzero(affected)
+    if len(cols):
+        needed = catalog.set_amounts[state.pending][:, cols].max(axis=0, initial=0)
+        furn_short = np.maximum(needed - furn_qty[cols], 0)
+        craft_short = np.where(catalog.craftable[cols], furn_short, 0)
+        delta = craft_short - state.craft_short[cols]
+        state.mat_needed[:] += delta @ catalog.recipes[cols]
+        state.needed[cols] = needed
+        state.craft_short[cols] = craft_short
+        state.buy_short[cols] = furn_short - craft_short
+
+    state.owned[:] = owned
+    state.claimed[:] = claimed
+    state.furn_qty[:] = furn_qty
+    state.mat_qty[:] = mat_qty
+
+    # The furnishing ids whose rows were recomputed
+    return cols
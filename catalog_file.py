@@ -0,0 +1,198 @@
+from typing import List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import math
+import mmap
+import struct
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import catalog
+
+# File layout: magic, header length, JSON header, then 64-byte aligned arrays.
+# The header maps every array to its dtype, shape and offset in the file. The
+# catalog's compact arrays, the set furnishings and the recipes as offsets
+# into flat uint16 id and amount arrays, are stored as it holds them. A loaded
+# catalog uses read-only views of the mapped file, so every process shares
+# its pages, and only builds a dense matrix once something needs it.
+MAGIC = b"FGSCAT04"
+ALIGNMENT = 64
+NAME_KINDS = ("set_names", "characters", "furnishings", "materials")
+# The dtype pandas gives an index of names, which loaded names keep
+NAME_DTYPE = pd.Index(["name"]).dtype
+
+
+def source_digest(source: bytes) -> str:
+    return hashlib.sha256(source).hexdigest()
+
+
+def pack_catalog(cat: catalog.Catalog, digest: str) -> bytes:
+    # Every kind of name is stored once, laid out like an Arrow string array
+    arrays = {}
+    for kind in NAME_KINDS:
+        encoded = [name.encode() for name in getattr(cat, kind)]
+        arrays[f"{kind}.offsets"] = np.cumsum([0, *map(len, encoded)], dtype=np.int64)
+        arrays[f"{kind}.data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    for field in catalog.ARRAY_FIELDS:
+        arrays[field] = getattr(cat, field)
+    for field in catalog.COMPOUND_FIELDS:
+        for part, array in getattr(cat, field)._asdict().items():
+            arrays[f"{field}.{part}"] = array
+    # The levels are one flat array split at the offsets
+    arrays["material_levels"] = np.concatenate(
+        [np.zeros(0, np.uint16), *cat.material_levels]
+    )
+    arrays["material_level_offsets"] = np.cumsum(
+        [0, *map(len, cat.material_levels)], dtype=np.int32
+    )
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        offset += -offset % ALIGNMENT
+        layout[name] = [array.dtype.str, list(array.shape), offset]
+        offset += array.nbytes
+
+    header = json.dumps(
+        {"version": cat.version, "source_sha256": digest, "arrays": layout}
+    ).encode()
+    start = len(MAGIC) + 4 + len(header)
+    start += -start % ALIGNMENT
+
+    body = bytearray(start + offset)
+    body[: len(MAGIC)] = MAGIC
+    body[len(MAGIC) : len(MAGIC) + 4] = struct.pack("<I", len(header))
+    body[len(MAGIC) + 4 : len(MAGIC) + 4 + len(header)] = header
+    for name, array in arrays.items():
+        position = start + layout[name][2]
+        body[position : position + array.nbytes] = np.ascontiguousarray(array).tobytes()
+
+    return bytes(body)
+
+
+def build_catalog_file(source_path: str, path: str, version: int = 0) -> None:
+    with open(source_path, "rb") as file:
+        source = file.read()
+    cat = catalog.compile_catalog(json.loads(source), version=version)
+
+    with open(path, "wb") as file:
+        file.write(pack_catalog(cat, source_digest(source)))
+
+
+def _read_header(buffer) -> dict:
+    if buffer[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not a compiled catalog file of this version, rebuild it")
+    (length,) = struct.unpack_from("<I", buffer, len(MAGIC))
+    header = json.loads(buffer[len(MAGIC) + 4 : len(MAGIC) + 4 + length])
+    start = len(MAGIC) + 4 + length
+    header["start"] = start + -start % ALIGNMENT
+
+    return header
+
+
+def _names(offsets: np.ndarray, data: np.ndarray) -> Tuple[List[str], pd.Index]:
+    # An Arrow string array over the buffer, which pandas keeps its names in
+    # as well, so the index doesn't copy them either
+    names = pa.LargeStringArray.from_buffers(
+        len(offsets) - 1, pa.py_buffer(offsets), pa.py_buffer(data)
+    )
+    if getattr(NAME_DTYPE, "storage", None) == "pyarrow":
+        index = pd.Index(pd.arrays.ArrowStringArray(names, dtype=NAME_DTYPE))
+    else:
+        index = pd.Index(names.to_pylist())
+
+    return (names.to_pylist(), index)
+
+
+def unpack_catalog(buffer) -> catalog.Catalog:
+    # Every array is a view of the buffer
+    header = _read_header(buffer)
+    arrays = {
+        name: np.frombuffer(
+            buffer, dtype, math.prod(shape), header["start"] + offset
+        ).reshape(shape)
+        for name, (dtype, shape, offset) in header["arrays"].items()
+    }
+    (names, indexes) = zip(
+        *(
+            _names(arrays.pop(f"{kind}.offsets"), arrays.pop(f"{kind}.data"))
+            for kind in NAME_KINDS
+        )
+    )
+
+    levels = arrays.pop("material_levels")
+    bounds = arrays.pop("material_level_offsets").tolist()
+    arrays["material_levels"] = [levels[lo:hi] for lo, hi in zip(bounds, bounds[1:])]
+    for field, kind in catalog.COMPOUND_FIELDS.items():
+        arrays[field] = [arrays.pop(f"{field}.{part}") for part in kind._fields]
+
+    return catalog.catalog_from_arrays(header["version"], *names, arrays, indexes)
+
+
+def load_catalog_file(path: str, source_path: Optional[str] = None) -> catalog.Catalog:
+    # Mapped read-only, so processes loading the same file share its pages
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if source_path is not None:
+        with open(source_path, "rb") as file:
+            digest = source_digest(file.read())
+        if _read_header(buffer)["source_sha256"] != digest:
+            raise ValueError(f"{path} is out of date with {source_path}, rebuild it")
+
+    return unpack_catalog(buffer)
+
+
+def catalog_drift(cat: catalog.Catalog, source_path: str) -> List[str]:
+    # Compares against a fresh compile, not just the digest, so a file packed
+    # by a different build of the compiler is caught too
+    with open(source_path, "rb") as file:
+        expected = catalog.compile_catalog(json.load(file), version=cat.version)
+
+    drift = []
+    for field in catalog.Catalog._fields:
+        (loaded, compiled) = (getattr(cat, field), getattr(expected, field))
+        if field == "ids":
+            same = {kind: dict(ids) for kind, ids in loaded.items()} == {
+                kind: dict(ids) for kind, ids in compiled.items()
+            }
+        elif isinstance(compiled, np.ndarray):
+            same = np.array_equal(loaded, compiled)
+        elif isinstance(compiled, tuple):
+            # The material levels and the compound fields
+            same = len(loaded) == len(compiled) and all(
+                np.array_equal(loaded_part, compiled_part)
+                for loaded_part, compiled_part in zip(loaded, compiled)
+            )
+        elif hasattr(compiled, "equals"):
+            same = compiled.equals(loaded)
+        else:
+            same = loaded == compiled
+        if not same:
+            drift.append(field)
+
+    return drift
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile sets.json into a compact, memory-mappable catalog"
+    )
+    parser.add_argument("--source", default="sets.json")
+    parser.add_argument("--output", default="sets.catalog")
+    parser.add_argument("--version", type=int, default=0, help="catalog version")
+    parser.add_argument(
+        "--check", action="store_true", help="only check the output for drift"
+    )
+    args = parser.parse_args()
+
+    if not args.check:
+        build_catalog_file(args.source, args.output, args.version)
+
+    try:
+        drift = catalog_drift(load_catalog_file(args.output, args.source), args.source)
+    except ValueError as error:
+        drift = [str(error)]
+    for field in drift:
+        print(f"DRIFT: {field}")
+    raise SystemExit(1 if drift else 0)
@@ -1,49 +1,184 @@
-from typing import Union, Tuple
+from typing import List, Optional, Union, Tuple
+import hashlib
+import threading
+import time
+import numpy as np
 import pandas as pd
 import streamlit as st
-import pymongo
-import pymongo.database
-import pymongo.collection
-from pymongo.server_api import ServerApi
-from pymongo.mongo_client import MongoClient
+import catalog
+import metrics
+import snapshots
+import solver
+import storage
+import writes
 
 
 @st.cache_resource
-def init_connection() -> MongoClient:
-    return MongoClient(st.secrets["mongo"]["uri"], server_api=ServerApi("1"))
+def init_connection() -> "MongoClient":
+    # pymongo is only loaded by apps that use the Mongo backend
+    from pymongo.server_api import ServerApi
+    from pymongo.mongo_client import MongoClient
+    import schema
+
+    client = MongoClient(
+        st.secrets["mongo"]["uri"],
+        server_api=ServerApi("1"),
+        event_listeners=[metrics.command_timer()],
+    )
+    schema.ensure_indexes(client.furnishings)
+
+    return client
 
 
-def get_data() -> Tuple[
-    pymongo.collection.Collection,
-    pd.DataFrame,
-    pd.DataFrame,
-    pd.DataFrame,
-    pd.DataFrame,
-]:
-    client = init_connection()
-    db = client.furnishings
+@st.cache_resource
+def init_storage() -> storage.Storage:
+    # Mongo unless the secrets pick the embedded backend
+    config = st.secrets.get("storage", {})
+    if config.get("backend", "mongo") == "embedded":
+        return storage.EmbeddedStorage(
+            config.get("path", "furnishings.db"),
+            config.get("catalog", "sets.json"),
+        )
 
-    characters = pd.DataFrame(db.characters.find({}, {"character_name": 1, "_id": 0}))
-    materials = pd.DataFrame(db.materials.find({}, {"name": 1, "_id": 0}))
-    furnishings = pd.DataFrame(db.furnishings.find({}, {"name": 1, "_id": 0}))
-    sets = pd.DataFrame(db.sets.find({}, {"name": 1, "characters": 1, "_id": 0}))
-    sets = sets.explode("characters")
-    sets = sets.sort_values("name")
+    return storage.MongoStorage(init_connection().furnishings)
+
+
+# The catalog is shared by every session and only reloaded when the version
+# document changes, which is checked at most once per interval
+CATALOG_CHECK_INTERVAL = 60.0
+_catalog_lock = threading.Lock()
+_catalog_cache = {"catalog": None, "checked_at": 0.0}
+catalog_stats = {"hits": 0, "misses": 0, "reloads": 0}
+metrics.register(
+    lambda: [
+        ("catalog_cache_total", {"result": result}, count)
+        for result, count in catalog_stats.items()
+    ]
+)
 
-    inventory = db.inventory
-    user_inventory = inventory.find_one(
-        {"user_id": st.session_state.user_info["localId"]}
+
+def fetch_catalog(
+    store: storage.Storage, version: Optional[int] = None
+) -> catalog.Catalog:
+    if version is None:
+        version = store.catalog_version()
+
+    (set_docs, characters, materials, furnishings, recipes) = store.catalog_docs()
+
+    return catalog.compile_catalog(
+        set_docs,
+        character_names=characters,
+        material_names=materials,
+        furnishing_names=furnishings,
+        version=version,
+        material_recipes=recipes,
     )
 
+
+def load_catalog(force: bool = False) -> catalog.Catalog:
+    with _catalog_lock:
+        cached = _catalog_cache["catalog"]
+        now = time.monotonic()
+        if (
+            cached is not None
+            and not force
+            and now - _catalog_cache["checked_at"] < CATALOG_CHECK_INTERVAL
+        ):
+            catalog_stats["hits"] += 1
+            return cached
+
+        store = init_storage()
+        version = store.catalog_version()
+        _catalog_cache["checked_at"] = now
+        if cached is not None and not force and cached.version == version:
+            catalog_stats["hits"] += 1
+            return cached
+
+        catalog_stats["misses" if cached is None else "reloads"] += 1
+        with metrics.span("catalog load"):
+            _catalog_cache["catalog"] = fetch_catalog(store, version)
+
+        return _catalog_cache["catalog"]
+
+
+def reload_catalog() -> catalog.Catalog:
+    return load_catalog(force=True)
+
+
+# Every written save has the user's stored requirements redone
+writes.on_written(
+    lambda write: snapshots.request(write.store, [write.user_id], load_catalog)
+)
+
+
+def new_inventory(cat: catalog.Catalog, user_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "characters": {char: False for char in cat.characters},
+        "materials": {mat: 0 for mat in cat.materials},
+        "furnishings": {furn: 0 for furn in cat.furnishings},
+        "sets": [],
+        "revision": 0,
+    }
+
+
+def load_inventory(store: storage.Storage, refresh: bool = False) -> dict:
+    # The user's document is kept in the session and only re-read from storage
+    # when asked to or when a write shows that someone else changed it
+    _check_writes()
+    if (
+        "inventory" in st.session_state
+        and not refresh
+        and not st.session_state.get("inventory_stale", False)
+    ):
+        return st.session_state.inventory
+
+    # Saves still waiting to be written would be missing from what is read
+    writes.flush(st.session_state.user_info["localId"])
+    cat = load_catalog()
+    with metrics.span("inventory fetch"):
+        user_inventory = store.find_inventory(st.session_state.user_info["localId"])
+
     if user_inventory is None:
-        user_inventory = {
-            "user_id": st.session_state.user_info["localId"],
-            "characters": {char: False for char in characters["character_name"]},
-            "materials": {mat: 0 for mat in materials["name"]},
-            "furnishings": {furn: 0 for furn in furnishings["name"]},
-            "sets": [],
-        }
-        inventory.insert_one(user_inventory)
+        user_inventory = new_inventory(cat, st.session_state.user_info["localId"])
+        store.insert_inventory(user_inventory)
+
+    st.session_state.inventory = user_inventory
+    st.session_state.inventory_stale = False
+
+    return user_inventory
+
+
+def refresh_inventory() -> None:
+    st.session_state.inventory_stale = True
+
+
+def _check_writes() -> None:
+    # Drops the session's saves that are done. One that could not be written,
+    # because someone else changed the inventory first, has it reloaded.
+    queued = st.session_state.get("queued_writes", [])
+    done = [write for write in queued if write.done.is_set()]
+    if any(not write.written for write in done):
+        st.session_state.inventory_stale = True
+        st.session_state.save_failed = True
+    st.session_state.queued_writes = [write for write in queued if write not in done]
+
+
+def save_failed() -> bool:
+    # True once for every failure of this session's saves
+    _check_writes()
+
+    return st.session_state.pop("save_failed", False)
+
+
+@metrics.timed("inventory frames")
+def _inventory_frames(
+    cat: catalog.Catalog, user_inventory: dict
+) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    characters = pd.DataFrame({"character_name": cat.characters})
+    materials = pd.DataFrame({"name": cat.materials})
+    furnishings = pd.DataFrame({"name": cat.furnishings})
+    sets = cat.pairs.to_frame(index=False)
 
     owned_chars = pd.DataFrame(
         list(user_inventory["characters"].items()), columns=["character_name", "owned"]
@@ -70,70 +205,190 @@ def get_data() -> Tuple[
     sets_list = pd.merge(sets, owned_sets, on=["name", "characters"], how="left")
     sets_list.claimed = sets_list.claimed.fillna(False).infer_objects(copy=False)
 
-    return (inventory, chars_list, mats_list, furn_list, sets_list)
+    return (chars_list, mats_list, furn_list, sets_list)
 
 
-def update_chars(
-    inventory: pymongo.collection.Collection, char_df: pd.DataFrame
-) -> bool:
-    chars = char_df.set_index("character_name")["owned"].to_dict()
-    result = inventory.update_one(
-        {"user_id": st.session_state.user_info["localId"]},
-        {"$set": {"characters": chars}},
-    )
+def get_data() -> (
+    Tuple[
+        storage.Storage,
+        pd.DataFrame,
+        pd.DataFrame,
+        pd.DataFrame,
+        pd.DataFrame,
+    ]
+):
+    store = init_storage()
+    cat = load_catalog()
+    user_inventory = load_inventory(store)
 
-    return True if result.matched_count > 0 else False
+    # Reuse the frames until the catalog or the inventory revision changes
+    cached = st.session_state.get("inventory_frames")
+    if cached and cached[0] is cat and cached[1] == user_inventory["revision"]:
+        return (store, *cached[2])
 
+    frames = _inventory_frames(cat, user_inventory)
+    st.session_state.inventory_frames = (cat, user_inventory["revision"], frames)
 
-def update_mats(inventory: pymongo.collection.Collection, mat_df: pd.DataFrame) -> bool:
-    mats = mat_df.set_index("name")["quantity"].to_dict()
-    result = inventory.update_one(
-        {"user_id": st.session_state.user_info["localId"]},
-        {"$set": {"materials": mats}},
-    )
+    return (store, *frames)
 
-    return True if result.matched_count > 0 else False
 
+def _dotted_changes(field: str, current: dict, edited: dict) -> dict:
+    # Names that Mongo can't use in a dotted path replace the whole field
+    if any("." in key or key.startswith("$") for key in edited):
+        return {field: edited} if edited != current else {}
 
-def update_furns(
-    inventory: pymongo.collection.Collection, furn_df: pd.DataFrame
+    return {
+        f"{field}.{key}": value
+        for key, value in edited.items()
+        if key not in current or current[key] != value
+    }
+
+
+def _write_inventory(
+    store: storage.Storage,
+    changes: dict,
+    new_sets: Optional[List[dict]] = None,
 ) -> bool:
-    furn = furn_df.set_index("name")["quantity"].to_dict()
-    result = inventory.update_one(
-        {"user_id": st.session_state.user_info["localId"]},
-        {"$set": {"furnishings": furn}},
+    new_sets = new_sets or []
+    if not changes and not new_sets:
+        return True
+
+    # Saves are written in the background, merged with the user's other saves
+    # of the next few seconds, so True only means the save was accepted. The
+    # write only goes through if nobody else has changed the document since
+    # it was loaded; save_failed reports it on a later rerun otherwise. Only
+    # the session that made the save is told.
+    user_inventory = load_inventory(store)
+    queued = writes.submit(
+        store,
+        user_inventory["user_id"],
+        user_inventory["revision"],
+        len(user_inventory["sets"]),
+        changes,
+        new_sets,
     )
+    if queued is None:
+        # Reloaded, with any pending saves written first, to edit again
+        st.session_state.inventory_stale = True
+        return False
+    # Merged saves share one write
+    session_writes = st.session_state.setdefault("queued_writes", [])
+    if queued not in session_writes:
+        session_writes.append(queued)
+
+    for path, value in changes.items():
+        storage.apply_change(user_inventory, path, value)
+    user_inventory["sets"].extend(new_sets)
+    user_inventory["revision"] += 1
+
+    return True
+
+
+def inventory_changes(user_inventory: dict, edits: dict) -> Tuple[dict, List[dict]]:
+    # Edits are shaped like the document, except that sets map each set name
+    # to its claims by character
+    changes = {}
+    for field in ("characters", "materials", "furnishings"):
+        if field in edits:
+            changes.update(_dotted_changes(field, user_inventory[field], edits[field]))
+
+    stored_sets = user_inventory["sets"]
+    positions = {stored["name"]: pos for pos, stored in enumerate(stored_sets)}
+    new_sets = []
+    for name, character_info in edits.get("sets", {}).items():
+        if name in positions:
+            pos = positions[name]
+            changes.update(
+                _dotted_changes(
+                    f"sets.{pos}.characters",
+                    stored_sets[pos]["characters"],
+                    character_info,
+                )
+            )
+        # Sets that were never stored only need writing once something is claimed
+        elif any(character_info.values()):
+            new_sets.append({"name": name, "characters": character_info})
+
+    return (changes, new_sets)
+
+
+def update_chars(store: storage.Storage, char_df: pd.DataFrame) -> bool:
+    chars = char_df.set_index("character_name")["owned"].to_dict()
+    edits = {"characters": chars}
+    return _write_inventory(store, *inventory_changes(load_inventory(store), edits))
 
-    return True if result.matched_count > 0 else False
 
+def update_mats(store: storage.Storage, mat_df: pd.DataFrame) -> bool:
+    mats = mat_df.set_index("name")["quantity"].to_dict()
+    edits = {"materials": mats}
+    return _write_inventory(store, *inventory_changes(load_inventory(store), edits))
 
-def update_sets(
-    inventory: pymongo.collection.Collection, sets_df: pd.DataFrame
-) -> bool:
-    # Get unique values of 'name' column
-    unique_names = sets_df["name"].unique()
-
-    # Create the array
-    sets = []
-    for name in unique_names:
-        subset_df = sets_df[sets_df["name"] == name]
-        character_info = {
-            char: claimed
-            for char, claimed in zip(subset_df["characters"], subset_df["claimed"])
-        }
-        sets.append(
-            {
-                "name": name,
-                "characters": character_info,
-            }
-        )
 
-    result = inventory.update_one(
-        {"user_id": st.session_state.user_info["localId"]},
-        {"$set": {"sets": sets}},
+def update_furns(store: storage.Storage, furn_df: pd.DataFrame) -> bool:
+    furn = furn_df.set_index("name")["quantity"].to_dict()
+    edits = {"furnishings": furn}
+    return _write_inventory(store, *inventory_changes(load_inventory(store), edits))
+
+
+def update_sets(store: storage.Storage, sets_df: pd.DataFrame) -> bool:
+    # Group the claims by set, like the stored array
+    claims = {}
+    for name, char, claimed in zip(
+        sets_df["name"], sets_df["characters"], sets_df["claimed"]
+    ):
+        claims.setdefault(name, {})[char] = claimed
+
+    edits = {"sets": claims}
+    return _write_inventory(store, *inventory_changes(load_inventory(store), edits))
+
+
+@metrics.timed("requirements frames")
+def _requirements_frames(
+    cat: catalog.Catalog,
+    pending: np.ndarray,
+    buy_short: np.ndarray,
+    craft_short: np.ndarray,
+    mat_needed: np.ndarray,
+    furn_qty: np.ndarray,
+    mat_qty: np.ndarray,
+) -> Union[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], None]:
+    if not pending.any():
+        return None
+
+    craft_idx = np.flatnonzero(craft_short)
+    needed_furns = pd.DataFrame(
+        {
+            "name": cat.furnishings.array.take(craft_idx),
+            "amount": craft_short[craft_idx],
+            "quantity": furn_qty[craft_idx],
+        },
+        copy=False,
+    )
+
+    buy_idx = np.flatnonzero(buy_short)
+    buy_furns = pd.DataFrame(
+        {
+            "name": cat.furnishings.array.take(buy_idx),
+            "amount": buy_short[buy_idx],
+            "quantity": furn_qty[buy_idx],
+        },
+        copy=False,
+    )
+
+    # Intermediates that are short are crafted, adding to their inputs' needs
+    (mat_needed, mat_short) = catalog.expand_materials(cat, mat_needed, mat_qty)
+    mat_idx = np.flatnonzero(mat_short)
+    needed_mats = pd.DataFrame(
+        {
+            "name": cat.materials.array.take(mat_idx),
+            "quantity_needed": mat_needed[mat_idx],
+            "quantity_mat": mat_qty[mat_idx],
+            "quantity_diff": mat_short[mat_idx],
+        },
+        copy=False,
     )
 
-    return True if result.matched_count > 0 else False
+    return (needed_furns, buy_furns, needed_mats)
 
 
 def calculate_requirements(
@@ -141,71 +396,224 @@ def calculate_requirements(
     sets_df: pd.DataFrame,
     furn_df: pd.DataFrame,
     mat_df: pd.DataFrame,
-    db: pymongo.database.Database,
 ) -> Union[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], None]:
-    owned_chars_true = char_df[char_df["owned"] == True]
-    unclaimed_sets = sets_df[sets_df["claimed"] == False]
-    unclaimed_sets = unclaimed_sets[
-        unclaimed_sets["characters"].isin(owned_chars_true["character_name"])
-    ]
-    unclaimed_sets = unclaimed_sets.name.unique().tolist()
-    gift_sets = pd.DataFrame(db.sets.find({"name": {"$in": unclaimed_sets}}))
-
-    if not gift_sets.empty:
-        needed_furns = gift_sets.explode("materials")
-
-        # Extract the 'name', 'recipe', and 'amount' fields from the 'materials' column
-        needed_furns["material_name"] = needed_furns["materials"].apply(
-            lambda x: x["name"]
+    cat = load_catalog()
+    with metrics.span("requirements vectors"):
+        (owned, claimed, furn_qty, mat_qty) = catalog.inventory_vectors(
+            cat, char_df, sets_df, furn_df, mat_df
         )
-        needed_furns["recipe"] = needed_furns["materials"].apply(lambda x: x["recipe"])
-        needed_furns["amount"] = needed_furns["materials"].apply(lambda x: x["amount"])
-
-        # Create a new DataFrame with only the 'material_name', 'recipe', and 'amount' columns
-        needed_furns = needed_furns[["material_name", "recipe", "amount"]]
-        idx = (
-            needed_furns.groupby("material_name")["amount"].transform("max")
-            == needed_furns["amount"]
+    with metrics.span("requirements shortfalls"):
+        (pending, buy_short, craft_short, mat_needed) = catalog.compute_shortfalls(
+            cat, owned, claimed, furn_qty, mat_qty
         )
-        needed_furns = needed_furns[idx]
-
-        # Merge gift_sets and furn_df on 'material_name'
-        needed_furns = pd.merge(
-            needed_furns,
-            furn_df[["name", "quantity"]],
-            left_on="material_name",
-            right_on="name",
-            how="left",
+
+    return _requirements_frames(
+        cat, pending, buy_short, craft_short, mat_needed, furn_qty, mat_qty
+    )
+
+
+def inventory_requirements(
+    cat: catalog.Catalog, user_inventory: dict
+) -> Union[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], None]:
+    # The same as calculate_requirements, from an inventory document
+    (owned, claimed, furn_qty, mat_qty) = (
+        matrix[0] for matrix in catalog.inventory_matrices(cat, [user_inventory])
+    )
+    (pending, buy_short, craft_short, mat_needed) = catalog.compute_shortfalls(
+        cat, owned, claimed, furn_qty, mat_qty
+    )
+
+    return _requirements_frames(
+        cat, pending, buy_short, craft_short, mat_needed, furn_qty, mat_qty
+    )
+
+
+def unsaved_edits(
+    char_df: pd.DataFrame,
+    sets_df: pd.DataFrame,
+    furn_df: pd.DataFrame,
+    mat_df: pd.DataFrame,
+) -> bool:
+    (_, chars_list, mats_list, furn_list, sets_list) = get_data()
+
+    return not all(
+        np.array_equal(edited[column].to_numpy(), saved[column].to_numpy())
+        for edited, saved, column in (
+            (char_df, chars_list, "owned"),
+            (sets_df, sets_list, "claimed"),
+            (furn_df, furn_list, "quantity"),
+            (mat_df, mats_list, "quantity"),
         )
+    )
+
 
-        # Filter rows where 'amount' is >= 'quantity'
-        needed_furns = needed_furns[needed_furns["amount"] >= needed_furns["quantity"]]
-        needed_furns["amount"] = needed_furns["amount"] - needed_furns["quantity"]
-        needed_furns = needed_furns[needed_furns["amount"] > 0]
+# A session that asked for a refresh waits before reading the store again,
+# backing off from the first interval up to the second while still stale
+SNAPSHOT_RECHECK = (1.0, 60.0)
+
+
+def requirements_snapshot(store: storage.Storage) -> Optional[dict]:
+    # The stored requirements of the user, if they are as of the inventory and
+    # catalog in use. Otherwise a refresh is asked for and None returned.
+    cat = load_catalog()
+    user_inventory = load_inventory(store)
+    user_id = user_inventory["user_id"]
+    key = (user_id, user_inventory["revision"], cat.version)
+    asked = st.session_state.get("snapshot_request")
+    if asked is not None and asked["key"] != key:
+        asked = None
+    now = time.monotonic()
+    if asked is not None and now < asked["due"]:
+        metrics.inc("requirements_snapshot_total", result="waiting")
+        return None
 
-        mask = needed_furns["recipe"].apply(lambda x: x == [])
-        buy_furns = needed_furns[mask]
-        needed_furns = needed_furns[~mask]
+    with metrics.span("requirements snapshot"):
+        snapshot = store.find_requirements(user_id)
 
-        # Explode the 'recipe' column and keep the 'amount' column
-        needed_mats = needed_furns.explode("recipe").reset_index()
+    if snapshot is not None and snapshots.current(snapshot, user_inventory, cat):
+        metrics.inc("requirements_snapshot_total", result="current")
+        st.session_state.pop("snapshot_request", None)
+        return snapshot
 
-        # Extract the 'name' and 'quantity' fields from the 'recipe' column
-        needed_mats["name"] = needed_mats["recipe"].apply(lambda x: x["name"])
-        needed_mats["quantity"] = needed_mats["recipe"].apply(lambda x: x["quantity"])
+    metrics.inc(
+        "requirements_snapshot_total",
+        result="missing" if snapshot is None else "stale",
+    )
+    # Saves still waiting are refreshed for once they are written
+    if not writes.is_pending(user_id):
+        snapshots.request(store, [user_id], load_catalog)
 
-        # Multiply the 'quantity' by the 'amount'
-        needed_mats["quantity"] *= needed_mats["amount"]
+    delay = SNAPSHOT_RECHECK[0] if asked is None else asked["delay"] * 2
+    delay = min(delay, SNAPSHOT_RECHECK[1])
+    st.session_state.snapshot_request = {"key": key, "due": now + delay, "delay": delay}
 
-        # Select only the 'name' and 'quantity' columns
-        needed_mats = needed_mats[["name", "quantity"]].groupby("name").sum("quantity")
+    return None
 
-        needed_mats = needed_mats.merge(mat_df, on="name", suffixes=("_needed", "_mat"))
-        needed_mats["quantity_diff"] = (
-            needed_mats["quantity_needed"] - needed_mats["quantity_mat"]
+
+def snapshot_frames(
+    snapshot: dict,
+) -> Union[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], None]:
+    # The names and amounts of live_requirements' frames
+    if not snapshot["pending_sets"]:
+        return None
+
+    def frame(entries: dict, column: str) -> pd.DataFrame:
+        return pd.DataFrame(
+            {"name": list(entries), column: list(entries.values())},
+            columns=["name", column],
         )
-        needed_mats = needed_mats[needed_mats["quantity_diff"] > 0]
 
-        return (needed_furns, buy_furns, needed_mats)
+    return (
+        frame(snapshot["craft"], "amount"),
+        frame(snapshot["buy"], "amount"),
+        frame(snapshot["materials"], "quantity_diff"),
+    )
+
+
+def live_requirements(
+    char_df: pd.DataFrame,
+    sets_df: pd.DataFrame,
+    furn_df: pd.DataFrame,
+    mat_df: pd.DataFrame,
+) -> Union[Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], None]:
+    cat = load_catalog()
+    with metrics.span("requirements vectors"):
+        vectors = catalog.inventory_vectors(cat, char_df, sets_df, furn_df, mat_df)
+
+    # Keep the last result in the session and only redo the rows an edit touches
+    cached = st.session_state.get("requirements_state")
+    if cached is None or cached[0] is not cat:
+        with metrics.span("requirements start"):
+            state = catalog.start_requirements(cat, *vectors)
+        st.session_state.requirements_state = (cat, state)
     else:
+        state = cached[1]
+        with metrics.span("requirements update"):
+            catalog.update_requirements(cat, state, *vectors)
+
+    return _requirements_frames(
+        cat,
+        state.pending,
+        state.buy_short,
+        state.craft_short,
+        state.mat_needed,
+        state.furn_qty,
+        state.mat_qty,
+    )
+
+
+def character_sets(name: str) -> pd.DataFrame:
+    # The gift sets a character can claim
+    cat = load_catalog()
+    set_ids = cat.character_sets.of(cat.ids["characters"][name])
+
+    return pd.DataFrame({"name": cat.set_names[set_ids]})
+
+
+def furnishing_uses(name: str) -> pd.DataFrame:
+    # The gift sets needing a furnishing, with how many each of them needs
+    cat = load_catalog()
+    furn = cat.ids["furnishings"][name]
+    set_ids = cat.furnishing_sets.of(furn)
+
+    return pd.DataFrame(
+        {"name": cat.set_names[set_ids], "amount": cat.set_amounts[set_ids, furn]}
+    )
+
+
+def material_uses(name: str) -> pd.DataFrame:
+    # The furnishings crafted from a material, with how much of it one takes
+    # and how many gift sets need the furnishing
+    cat = load_catalog()
+    mat = cat.ids["materials"][name]
+    furn_ids = cat.material_furnishings.of(mat)
+
+    return pd.DataFrame(
+        {
+            "name": cat.furnishings[furn_ids],
+            "quantity": cat.recipes[furn_ids, mat],
+            "sets": np.diff(cat.furnishing_sets.offsets)[furn_ids],
+        }
+    )
+
+
+def claim_order(
+    char_df: pd.DataFrame,
+    sets_df: pd.DataFrame,
+    furn_df: pd.DataFrame,
+    mat_df: pd.DataFrame,
+    rewards: bool = False,
+    compute: bool = True,
+) -> Optional[Tuple[pd.DataFrame, bool]]:
+    # The search takes up to its whole budget, so the last plan is kept in the
+    # session for as long as the inventory and rewards stay the same. Without
+    # compute only that plan is returned, or None.
+    cat = load_catalog()
+    vectors = catalog.inventory_vectors(cat, char_df, sets_df, furn_df, mat_df)
+    key = hashlib.sha256(
+        b"".join(np.ascontiguousarray(vector).tobytes() for vector in vectors)
+    ).hexdigest()
+    key = (cat.version, rewards, key)
+
+    cached = st.session_state.get("claim_plan")
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    if not compute:
         return None
+
+    (owned, claimed, furn_qty, mat_qty) = vectors
+    with metrics.span("claim order"):
+        plan = solver.plan_claims(cat, owned, claimed, furn_qty, mat_qty, rewards)
+
+    # Characters that can still claim each chosen set
+    open_pairs = ~claimed & owned[cat.pair_char]
+    open_count = np.bincount(cat.pair_set[open_pairs], minlength=len(cat.set_names))
+    claims = pd.DataFrame(
+        {
+            "name": cat.set_names[plan.sets],
+            "characters": open_count[plan.sets],
+        }
+    )
+    st.session_state.claim_plan = (key, (claims, plan.optimal))
+
+    return (claims, plan.optimal)
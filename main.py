@@ -1,10 +1,18 @@
-import auth
+import time
+import uuid
 import streamlit as st
-import data_controller as data
+import metrics
 
+rerun_started = time.perf_counter()
+metrics_config = st.secrets.get("metrics", {})
+if metrics_config.get("port"):
+    metrics.serve(int(metrics_config["port"]), metrics_config.get("host", "127.0.0.1"))
+metrics.count_rerun(st.session_state.setdefault("session_id", uuid.uuid4().hex[:12]))
 
-client = data.init_connection()
-db = client.furnishings
+# Opt-in profile of the rerun started by clicking the sidebar button
+profiler = None
+if st.session_state.pop("profile_rerun", False):
+    profiler = metrics.start_profile()
 
 st.title("Genshin Furnishing Helper")
 st.write(
@@ -12,6 +20,10 @@ st.write(
 )
 
 if "user_info" not in st.session_state:
+    # The data layer, with pandas and the database drivers, is only loaded
+    # once signed in, and the sign-in page only needs auth
+    import auth
+
     # col1, col2, col3 = st.columns([1, 2, 1])
     st.divider()
     # Authentication form layout
@@ -63,130 +75,37 @@ else:
     st.write("Start by selecting the characters, materials, and furnishings you own.")
     st.write("Then check the gift sets you have claimed rewards for.")
     st.write(
-        "Finally, click the 'Calculate requirements' on the Requirements tab to see the needed furnishings and materials."
+        "Finally, open the Requirements tab to see the needed furnishings and materials, which update as you edit."
     )
 
+    import data_controller as data
+    import views
+
     char_tab, mat_tab, furn_tab, sets_tab, calc_tab = st.tabs(
         ["Characters", "Materials", "Furnishings", "Sets", "Requirements"]
     )
 
-    (inventory, chars_list, mats_list, furn_list, sets_list) = data.get_data()
+    if st.button("Refresh data", key="refresh"):
+        data.refresh_inventory()
+    views.notify_save_failed()
 
     with char_tab:
-        st.header("Characters")
-        char_df = st.data_editor(
-            chars_list,
-            column_config={
-                "owned": st.column_config.CheckboxColumn(
-                    "Owned?",
-                    help="Select your **owned** characters",
-                    default=False,
-                )
-            },
-            disabled=["character_name"],
-            hide_index=True,
-        )
-
-        if st.button("Save changes", key="save_chars", type="primary"):
-            if data.update_chars(inventory, char_df):
-                st.success("Data successfully updated!")
-            else:
-                st.error("Data update failed!")
-
+        views.characters_tab()
     with mat_tab:
-        st.header("Materials")
-        mat_df = st.data_editor(
-            mats_list,
-            column_config={
-                "quantity": st.column_config.NumberColumn(
-                    "Quantity owned",
-                    help="Quantity of the materials you own",
-                    min_value=0,
-                    max_value=20000,
-                    step=1,
-                )
-            },
-            disabled=["name"],
-            hide_index=True,
-        )
-
-        if st.button("Save changes", key="save_mats", type="primary"):
-            if data.update_mats(inventory, mat_df):
-                st.success("Data successfully updated!")
-            else:
-                st.error("Data update failed!")
-
+        views.materials_tab()
     with furn_tab:
-        st.header("Furnishings")
-        furn_df = st.data_editor(
-            furn_list,
-            column_config={
-                "quantity": st.column_config.NumberColumn(
-                    "Quantity owned",
-                    help="Quantity of the furnishings you own",
-                    min_value=0,
-                    max_value=20000,
-                    step=1,
-                )
-            },
-            disabled=["name"],
-            hide_index=True,
-        )
-
-        if st.button("Save changes", key="save_furn", type="primary"):
-            if data.update_furns(inventory, furn_df):
-                st.success("Data successfully updated!")
-            else:
-                st.error("Data update failed!")
-
+        views.furnishings_tab()
     with sets_tab:
-        st.header("Gift Sets")
-        sets_df = st.data_editor(
-            sets_list,
-            column_config={
-                "claimed": st.column_config.CheckboxColumn(
-                    "Claimed?",
-                    help="Check the characters you have claimed rewards for",
-                    default=False,
-                )
-            },
-            disabled=["name", "characters"],
-            hide_index=True,
-        )
-
-        if st.button("Save changes", key="save_sets", type="primary"):
-            if data.update_sets(inventory, sets_df):
-                st.success("Data successfully updated!")
-            else:
-                st.error("Data update failed!")
-
+        views.sets_tab()
     with calc_tab:
-        st.header("Requirements")
-        if st.button("Calculate requirements", key="calc", type="primary"):
-            reqs = data.calculate_requirements(char_df, sets_df, furn_df, mat_df, db)
+        views.requirements_tab()
 
-            if reqs:
-                (needed_furns, buy_furns, needed_mats) = reqs
-
-                cols = st.columns(2)
-                with cols[0]:
-                    st.subheader("Furnishings to buy:")
-                    st.dataframe(
-                        buy_furns[["name", "amount"]],
-                        hide_index=True,
-                    )
-
-                    st.subheader("Materials needed:")
-                    st.dataframe(
-                        needed_mats[["name", "quantity_diff"]],
-                        hide_index=True,
-                    )
-
-                with cols[1]:
-                    st.subheader("Furnishings to craft:")
-                    st.dataframe(
-                        needed_furns[["name", "amount"]],
-                        hide_index=True,
-                    )
-            else:
-                st.write("There are no gift sets to claim.")
+metrics.observe("rerun_seconds", time.perf_counter() - rerun_started)
+if metrics_config.get("profiling"):
+    st.sidebar.button(
+        "Profile this rerun",
+        on_click=lambda: st.session_state.update(profile_rerun=True),
+    )
+if profiler is not None:
+    with st.sidebar.expander("Profile", expanded=True):
+        st.code(metrics.stop_profile(profiler))
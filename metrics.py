@@ -0,0 +1,207 @@
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import contextlib
+import cProfile
+import functools
+import http.server
+import io
+import pstats
+import threading
+import time
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+MAX_SESSIONS = 100
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Labels], float] = {}
+# Per bucket counts, then the count and sum of every observation
+_histograms: Dict[Tuple[str, Labels], List[float]] = {}
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+# Reruns of the most recently active sessions
+_session_reruns: "OrderedDict[str, int]" = OrderedDict()
+_server: Optional[http.server.ThreadingHTTPServer] = None
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for bucket, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[bucket] += 1
+                break
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+
+@contextlib.contextmanager
+def span(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=stage)
+
+
+def timed(stage: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def register(collector: Callable[[], Iterable[Sample]]) -> None:
+    # For values kept elsewhere, read when the metrics are scraped
+    with _lock:
+        _collectors.append(collector)
+
+
+def count_rerun(session: str) -> int:
+    inc("reruns_total")
+    with _lock:
+        reruns = _session_reruns.pop(session, 0) + 1
+        _session_reruns[session] = reruns
+        while len(_session_reruns) > MAX_SESSIONS:
+            _session_reruns.popitem(last=False)
+
+    return reruns
+
+
+def command_timer() -> "pymongo.monitoring.CommandListener":
+    # A listener timing every command a MongoClient sends, by command name.
+    # pymongo is only imported once a client is made.
+    from pymongo import monitoring
+
+    class CommandTimer(monitoring.CommandListener):
+        def __init__(self):
+            self.pending = {}
+
+        def started(self, event: monitoring.CommandStartedEvent) -> None:
+            self.pending[event.request_id] = time.perf_counter()
+
+        def _finished(self, event, failed: bool) -> None:
+            started = self.pending.pop(event.request_id, None)
+            if started is not None:
+                elapsed = time.perf_counter() - started
+                observe("mongo_command_seconds", elapsed, command=event.command_name)
+            if failed:
+                inc("mongo_command_errors_total", command=event.command_name)
+
+        def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+            self._finished(event, False)
+
+        def failed(self, event: monitoring.CommandFailedEvent) -> None:
+            self._finished(event, True)
+
+    return CommandTimer()
+
+
+def _format(name: str, labels: Labels, value: float) -> str:
+    if labels:
+        pairs = ",".join(
+            '{0}="{1}"'.format(key, value.replace("\\", "\\\\").replace('"', '\\"'))
+            for key, value in labels
+        )
+        name = f"{name}{{{pairs}}}"
+    return f"{name} {float(value)!r}"
+
+
+def render() -> str:
+    # The Prometheus text exposition format
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        sessions = dict(_session_reruns)
+        collectors = list(_collectors)
+
+    lines, typed = [], set()
+
+    def family(name: str, kind: str) -> None:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for name, labels in sorted(counters):
+        family(name, "counter")
+        lines.append(_format(name, labels, counters[(name, labels)]))
+    for session, reruns in sessions.items():
+        family("session_reruns_total", "counter")
+        lines.append(_format("session_reruns_total", (("session", session),), reruns))
+    for name, labels in sorted(histograms):
+        family(name, "histogram")
+        values = histograms[(name, labels)]
+        cumulative = 0
+        for bound, count in zip(BUCKETS, values):
+            cumulative += count
+            bucket = labels + (("le", f"{bound:g}"),)
+            lines.append(_format(f"{name}_bucket", bucket, cumulative))
+        lines.append(_format(f"{name}_bucket", labels + (("le", "+Inf"),), values[-2]))
+        lines.append(_format(f"{name}_count", labels, values[-2]))
+        lines.append(_format(f"{name}_sum", labels, values[-1]))
+    for collector in collectors:
+        for name, labels, value in collector():
+            lines.append(_format(name, _labels(labels), value))
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> http.server.ThreadingHTTPServer:
+    # Started once per process, later calls return the running server
+    global _server
+    with _lock:
+        if _server is None:
+            _server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+        return _server
+
+
+def start_profile() -> cProfile.Profile:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler: cProfile.Profile, limit: int = 30) -> str:
+    profiler.disable()
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(limit)
+
+    return report.getvalue()
@@ -0,0 +1,140 @@
+from typing import Dict, Iterator, List
+import argparse
+import pymongo
+import pymongo.collection
+import pymongo.database
+import pymongo.errors
+from pymongo.server_api import ServerApi
+from pymongo.mongo_client import MongoClient
+
+INDEXES = {
+    "inventory": [([("user_id", pymongo.ASCENDING)], {"unique": True})],
+    "sets": [([("name", pymongo.ASCENDING)], {})],
+    "furnishings": [([("name", pymongo.ASCENDING)], {})],
+    "materials": [([("name", pymongo.ASCENDING)], {})],
+    "characters": [([("character_name", pymongo.ASCENDING)], {})],
+    "requirements": [([("user_id", pymongo.ASCENDING)], {"unique": True})],
+}
+
+# Fields the app reads from an inventory document
+INVENTORY_FIELDS = {
+    "user_id": 1,
+    "revision": 1,
+    "characters": 1,
+    "materials": 1,
+    "furnishings": 1,
+    "sets": 1,
+}
+
+
+def duplicate_keys(collection: pymongo.collection.Collection, field: str) -> List:
+    groups = collection.aggregate(
+        [
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+    return [group["_id"] for group in groups]
+
+
+def ensure_indexes(db: pymongo.database.Database) -> None:
+    # create_index is a no-op when an identical index already exists
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection].create_index(keys, **options)
+            except pymongo.errors.DuplicateKeyError:
+                # Left from before the index was unique, and never merged
+                # automatically since each may hold edits
+                field = keys[0][0]
+                found = duplicate_keys(db[collection], field)
+                raise ValueError(
+                    f"{collection} has more than one document for {len(found)} "
+                    f"{field} values, such as {found[:3]}; run "
+                    "`python schema.py --dedupe` to keep the latest of each"
+                ) from None
+
+
+def dedupe(db: pymongo.database.Database) -> Dict[str, int]:
+    # Keeps each key's most revised document, the newest on a tie, and moves
+    # the rest to `<collection>_duplicates` so nothing is lost
+    moved = {}
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            if not options.get("unique"):
+                continue
+            field = keys[0][0]
+            moved[collection] = 0
+            for key in duplicate_keys(db[collection], field):
+                docs = db[collection].find({field: key})
+                extra = list(docs.sort([("revision", -1), ("_id", -1)]))[1:]
+                db[f"{collection}_duplicates"].insert_many(extra)
+                db[collection].delete_many(
+                    {"_id": {"$in": [doc["_id"] for doc in extra]}}
+                )
+                moved[collection] += len(extra)
+
+    return moved
+
+
+def _stages(plan: dict) -> Iterator[str]:
+    yield plan.get("stage", "")
+    for child in ("inputStage", "queryPlan"):
+        if child in plan:
+            yield from _stages(plan[child])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def check_query_plans(db: pymongo.database.Database) -> List[str]:
+    # The lookups on the hot path, any of them scanning a collection is flagged
+    queries = {
+        "inventory by user_id": db.inventory.find(
+            {"user_id": ""}, INVENTORY_FIELDS
+        ).limit(1),
+        "inventory by user_id and revision": db.inventory.find(
+            {"user_id": "", "revision": 0}, {"_id": 1}
+        ).limit(1),
+        "sets by name": db.sets.find({"name": {"$in": [""]}}),
+        "requirements by user_id": db.requirements.find({"user_id": ""}).limit(1),
+    }
+
+    flagged = []
+    for name, cursor in queries.items():
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in _stages(plan):
+            flagged.append(name)
+
+    return flagged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create the app's indexes and check the hot queries use them"
+    )
+    parser.add_argument("--uri", help="MongoDB URI, defaults to the app's secrets")
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="first keep only the latest document per unique key",
+    )
+    args = parser.parse_args()
+
+    if args.uri:
+        db = MongoClient(args.uri, server_api=ServerApi("1")).furnishings
+    else:
+        import streamlit as st
+
+        db = MongoClient(
+            st.secrets["mongo"]["uri"], server_api=ServerApi("1")
+        ).furnishings
+
+    if args.dedupe:
+        for collection, count in dedupe(db).items():
+            print(f"{collection}: {count} moved to {collection}_duplicates")
+    ensure_indexes(db)
+    flagged = check_query_plans(db)
+    for name in flagged:
+        print(f"COLLSCAN: {name}")
+    raise SystemExit(1 if flagged else 0)
@@ -0,0 +1,371 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import jwt
+import requests
+import uvicorn
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+import auth
+import catalog
+import data_controller as data
+import metrics
+import snapshots
+
+REQUIREMENT_FRAMES = ("craft", "buy", "materials")
+# The embedded backend stores quantities as 32-bit integers
+MAX_QUANTITY = 2**31 - 1
+
+
+class ResultCache:
+    # The most recently used results, each kept for at most `ttl` seconds.
+    # Shared by every request the process serves.
+    def __init__(self, size: int = 10000, ttl: float = 300.0):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() > entry[0]:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+
+            return entry[1]
+
+    def put(self, key: str, value: bytes) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+results = ResultCache()
+# Computations in flight by key, so identical concurrent queries share one
+_inflight: Dict[str, "asyncio.Future[bytes]"] = {}
+
+
+def inventory_key(cat: catalog.Catalog, user_inventory: dict) -> str:
+    # Equal inventories get equal keys whoever they belong to
+    state = {
+        field: user_inventory.get(field, {})
+        for field in ("characters", "materials", "furnishings")
+    }
+    state["sets"] = [
+        [stored["name"], stored["characters"]]
+        for stored in user_inventory.get("sets", [])
+    ]
+    state["catalog_version"] = cat.version
+    encoded = json.dumps(state, sort_keys=True, separators=(",", ":"))
+
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def requirements_body(cat: catalog.Catalog, user_inventory: dict) -> bytes:
+    with metrics.span("service requirements"):
+        frames = data.inventory_requirements(cat, user_inventory)
+        body = {"catalog_version": cat.version}
+        for name, frame in zip(REQUIREMENT_FRAMES, frames or (None,) * 3):
+            body[name] = [] if frame is None else frame.to_dict("records")
+
+        return json.dumps(body).encode()
+
+
+async def coalesced(key: str, compute: Callable[[], bytes]) -> bytes:
+    body = results.get(key)
+    if body is not None:
+        metrics.inc("service_cache_total", result="hit")
+        return body
+
+    task = _inflight.get(key)
+    if task is None:
+        metrics.inc("service_cache_total", result="miss")
+
+        def compute_and_store() -> bytes:
+            body = compute()
+            results.put(key, body)
+            return body
+
+        task = asyncio.ensure_future(asyncio.to_thread(compute_and_store))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        metrics.inc("service_cache_total", result="coalesced")
+
+    # A client hanging up must not cancel the others waiting on the result
+    return await asyncio.shield(task)
+
+
+async def _user_id(request: Request) -> str:
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        raise HTTPException(401, "Expected a Firebase ID token as a Bearer token")
+
+    try:
+        info = await asyncio.to_thread(auth.account_info, header[len("Bearer ") :])
+    except (jwt.PyJWTError, requests.exceptions.HTTPError, KeyError):
+        raise HTTPException(401, "Invalid ID token")
+
+    return info["localId"]
+
+
+async def _json_object(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Expected a JSON body")
+    if not isinstance(body, dict):
+        raise HTTPException(400, "Expected a JSON object")
+
+    return body
+
+
+def check_entries(cat: catalog.Catalog, field: str, entries) -> None:
+    # Every name must be in the catalog, with a flag for characters and a
+    # count for materials and furnishings
+    if not isinstance(entries, dict):
+        raise HTTPException(400, f"Expected {field} as an object")
+    for name, value in entries.items():
+        if name not in cat.ids[field]:
+            raise HTTPException(400, f"Unknown {field} entry {name!r}")
+        if field == "characters":
+            if not isinstance(value, bool):
+                raise HTTPException(400, f"Expected true or false for {name!r}")
+        elif (
+            isinstance(value, bool)
+            or not isinstance(value, int)
+            or not 0 <= value <= MAX_QUANTITY
+        ):
+            raise HTTPException(400, f"Expected a count of at least 0 for {name!r}")
+
+
+def check_claims(cat: catalog.Catalog, name, claims) -> None:
+    # Claims of a set, by characters that have the set
+    set_id = cat.ids["sets"].get(name) if isinstance(name, str) else None
+    if set_id is None:
+        raise HTTPException(400, f"Unknown gift set {name!r}")
+    if not isinstance(claims, dict):
+        raise HTTPException(400, f"Expected the claims of {name!r} as an object")
+    for char, value in claims.items():
+        char_id = cat.ids["characters"].get(char)
+        if char_id is None or cat.pair_ids[set_id, char_id] < 0:
+            raise HTTPException(400, f"{char!r} has no claim on {name!r}")
+        if not isinstance(value, bool):
+            raise HTTPException(400, f"Expected true or false for {char!r}")
+
+
+async def _stored_inventory(user_id: str) -> dict:
+    user_inventory = await asyncio.to_thread(
+        data.init_storage().find_inventory, user_id
+    )
+    if user_inventory is None:
+        raise HTTPException(404, "No inventory, create one first")
+    user_inventory.pop("_id", None)
+
+    return user_inventory
+
+
+async def get_inventory(request: Request) -> Response:
+    return JSONResponse(await _stored_inventory(await _user_id(request)))
+
+
+async def create_inventory(request: Request) -> Response:
+    user_id = await _user_id(request)
+    store = data.init_storage()
+
+    def create() -> Optional[dict]:
+        if store.find_inventory(user_id) is not None:
+            return None
+        user_inventory = data.new_inventory(data.load_catalog(), user_id)
+        store.insert_inventory(user_inventory)
+        user_inventory.pop("_id", None)
+        return user_inventory
+
+    user_inventory = await asyncio.to_thread(create)
+    if user_inventory is None:
+        raise HTTPException(409, "The inventory already exists")
+
+    return JSONResponse(user_inventory, status_code=201)
+
+
+async def update_inventory(request: Request) -> Response:
+    # Takes the revision the edits were made against, like the app's saves
+    user_id = await _user_id(request)
+    edits = await _json_object(request)
+    if not isinstance(edits.get("revision"), int):
+        raise HTTPException(400, "Expected the revision being edited")
+    user_inventory = await _stored_inventory(user_id)
+    if user_inventory["revision"] != edits["revision"]:
+        raise HTTPException(409, "The inventory was changed, reload it")
+
+    # Only the entries sent are edited. They are merged over the stored ones
+    # because a field with names Mongo can't use in a path is replaced whole.
+    cat = await asyncio.to_thread(data.load_catalog)
+    for field in ("characters", "materials", "furnishings"):
+        check_entries(cat, field, edits.get(field, {}))
+    if not isinstance(edits.get("sets", {}), dict):
+        raise HTTPException(400, "Expected sets as an object")
+    for name, claims in edits.get("sets", {}).items():
+        check_claims(cat, name, claims)
+    for field in ("characters", "materials", "furnishings"):
+        if field in edits:
+            edits[field] = {**user_inventory[field], **edits[field]}
+    (changes, new_sets) = data.inventory_changes(user_inventory, edits)
+
+    if changes or new_sets:
+        store = data.init_storage()
+        written = await asyncio.to_thread(
+            store.update_inventory,
+            user_id,
+            user_inventory["revision"],
+            len(user_inventory["sets"]),
+            changes,
+            new_sets,
+        )
+        if not written:
+            raise HTTPException(409, "The inventory was changed, reload it")
+        snapshots.request(store, [user_id], data.load_catalog)
+
+    return JSONResponse(await _stored_inventory(user_id))
+
+
+async def delete_inventory(request: Request) -> Response:
+    user_id = await _user_id(request)
+    if not await asyncio.to_thread(data.init_storage().delete_inventory, user_id):
+        raise HTTPException(404, "No inventory to delete")
+
+    return Response(status_code=204)
+
+
+async def _requirements(user_inventory: dict) -> Response:
+    cat = await asyncio.to_thread(data.load_catalog)
+    body = await coalesced(
+        inventory_key(cat, user_inventory),
+        lambda: requirements_body(cat, user_inventory),
+    )
+
+    return Response(body, media_type="application/json")
+
+
+async def stored_requirements(request: Request) -> Response:
+    return await _requirements(await _stored_inventory(await _user_id(request)))
+
+
+async def snapshot_requirements(request: Request) -> Response:
+    # The stored requirements as they are, in one lookup. Their revision and
+    # catalog_version say which inventory and catalog they were computed for.
+    user_id = await _user_id(request)
+    snapshot = await asyncio.to_thread(data.init_storage().find_requirements, user_id)
+    if snapshot is None:
+        raise HTTPException(404, "No stored requirements yet")
+
+    return JSONResponse(snapshot)
+
+
+async def posted_requirements(request: Request) -> Response:
+    # For an inventory sent with the request, nothing is stored
+    await _user_id(request)
+    user_inventory = await _json_object(request)
+    cat = await asyncio.to_thread(data.load_catalog)
+    for field in ("characters", "materials", "furnishings"):
+        check_entries(cat, field, user_inventory.setdefault(field, {}))
+    if not isinstance(user_inventory.setdefault("sets", []), list):
+        raise HTTPException(400, "Expected sets as a list")
+    for stored in user_inventory["sets"]:
+        if not isinstance(stored, dict):
+            raise HTTPException(400, "Expected every set as an object")
+        check_claims(cat, stored.get("name"), stored.get("characters"))
+
+    return await _requirements(user_inventory)
+
+
+async def get_metrics(request: Request) -> Response:
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def _timed(
+    endpoint: str, handler: Callable[[Request], Awaitable[Response]]
+) -> Callable[[Request], Awaitable[Response]]:
+    async def timed_handler(request: Request) -> Response:
+        started = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            metrics.observe(
+                "service_request_seconds",
+                time.perf_counter() - started,
+                endpoint=endpoint,
+            )
+
+    return timed_handler
+
+
+app = Starlette(
+    routes=[
+        Route("/inventory", _timed("get inventory", get_inventory), methods=["GET"]),
+        Route(
+            "/inventory",
+            _timed("create inventory", create_inventory),
+            methods=["POST"],
+        ),
+        Route(
+            "/inventory",
+            _timed("update inventory", update_inventory),
+            methods=["PATCH"],
+        ),
+        Route(
+            "/inventory",
+            _timed("delete inventory", delete_inventory),
+            methods=["DELETE"],
+        ),
+        Route(
+            "/requirements",
+            _timed("stored requirements", stored_requirements),
+            methods=["GET"],
+        ),
+        Route(
+            "/requirements/snapshot",
+            _timed("snapshot requirements", snapshot_requirements),
+            methods=["GET"],
+        ),
+        Route(
+            "/requirements",
+            _timed("posted requirements", posted_requirements),
+            methods=["POST"],
+        ),
+        Route("/metrics", get_metrics, methods=["GET"]),
+    ]
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve requirements and inventories as a JSON API"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--cache-size", type=int, default=10000, help="results kept in memory"
+    )
+    parser.add_argument(
+        "--ttl", type=float, default=300.0, help="seconds a result is kept"
+    )
+    args = parser.parse_args()
+
+    results.size = args.cache_size
+    results.ttl = args.ttl
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import numpy as np
+import catalog
+import metrics
+
+# Requirements are stored per user, as of the inventory revision and catalog
+# version they were computed from. After a user's inventory is written, a
+# background thread recomputes theirs, at most this many users per batch.
+REFRESH_BATCH = 100
+
+_cond = threading.Condition()
+# Users waiting for a refresh, oldest first, with where to find them
+_queued: "OrderedDict[str, Tuple[storage.Storage, Callable[[], catalog.Catalog]]]" = (
+    OrderedDict()
+)
+_state = {"thread": None, "busy": False}
+
+
+def _named_rows(names: List[str], matrix: np.ndarray) -> List[dict]:
+    # Name the non-zero entries of every row, split the flat lists by row
+    rows, cols = np.nonzero(matrix)
+    keys = [names[col] for col in cols.tolist()]
+    values = matrix[rows, cols].tolist()
+    bounds = np.searchsorted(rows, np.arange(len(matrix) + 1)).tolist()
+
+    return [dict(zip(keys[lo:hi], values[lo:hi])) for lo, hi in zip(bounds, bounds[1:])]
+
+
+def compute_batch(cat: catalog.Catalog, docs: List[dict]) -> List[dict]:
+    (owned, claimed, furn_qty, mat_qty) = catalog.inventory_matrices(cat, docs)
+    (pending, buy_short, craft_short, mat_needed) = catalog.compute_shortfalls(
+        cat, owned, claimed, furn_qty, mat_qty
+    )
+    (_, mat_short) = catalog.expand_materials(cat, mat_needed, mat_qty)
+
+    # Plain lists are much faster to pick single names from than an Index
+    furn_names = cat.furnishings.tolist()
+
+    return [
+        {
+            "user_id": doc["user_id"],
+            "revision": doc.get("revision", 0),
+            "catalog_version": cat.version,
+            "pending_sets": list(sets),
+            "buy": buy,
+            "craft": craft,
+            "materials": mats,
+        }
+        for doc, sets, buy, craft, mats in zip(
+            docs,
+            _named_rows(cat.set_names.tolist(), pending),
+            _named_rows(furn_names, buy_short),
+            _named_rows(furn_names, craft_short),
+            _named_rows(cat.materials.tolist(), mat_short),
+        )
+    ]
+
+
+def refresh(store: "storage.Storage", cat: catalog.Catalog, user_ids: List[str]) -> int:
+    # Recomputes and stores the users' requirements, returning how many of
+    # them still had an inventory
+    docs = [doc for doc in map(store.find_inventory, user_ids) if doc is not None]
+    if docs:
+        store.save_requirements(compute_batch(cat, docs))
+
+    return len(docs)
+
+
+def current(snapshot: dict, user_inventory: dict, cat: catalog.Catalog) -> bool:
+    return (
+        snapshot["revision"] == user_inventory["revision"]
+        and snapshot["catalog_version"] == cat.version
+    )
+
+
+def _start() -> None:
+    if _state["thread"] is None:
+        _state["thread"] = threading.Thread(
+            target=_run, name="requirements-refresh", daemon=True
+        )
+        _state["thread"].start()
+
+
+def request(
+    store: "storage.Storage",
+    user_ids: List[str],
+    load_catalog: Callable[[], catalog.Catalog],
+) -> None:
+    # The catalog is loaded when the refresh runs, so it is the newest one
+    with _cond:
+        _start()
+        for user_id in user_ids:
+            _queued[user_id] = (store, load_catalog)
+        _cond.notify_all()
+
+
+def _run() -> None:
+    while True:
+        with _cond:
+            while not _queued:
+                _cond.wait()
+            batch = [
+                _queued.popitem(last=False)
+                for _ in range(min(len(_queued), REFRESH_BATCH))
+            ]
+            _state["busy"] = True
+
+        groups: Dict[tuple, List[str]] = {}
+        for user_id, source in batch:
+            groups.setdefault(source, []).append(user_id)
+        for (store, load_catalog), user_ids in groups.items():
+            try:
+                with metrics.span("requirements refresh"):
+                    refreshed = refresh(store, load_catalog(), user_ids)
+                metrics.inc("requirements_refreshed_total", refreshed)
+            except Exception as error:
+                print(error)
+                metrics.inc("requirements_refresh_errors_total")
+
+        with _cond:
+            _state["busy"] = False
+            _cond.notify_all()
+
+
+def wait(timeout: Optional[float] = None) -> bool:
+    # True once every requested refresh is done, False on timing out
+    with _cond:
+        return _cond.wait_for(lambda: not _queued and not _state["busy"], timeout)
+
+
+def _depth():
+    with _cond:
+        return [("requirements_refresh_queue", {}, len(_queued))]
+
+
+metrics.register(_depth)
@@ -0,0 +1,106 @@
+from typing import List, NamedTuple
+import time
+import numpy as np
+import catalog
+
+
+class ClaimPlan(NamedTuple):
+    # Set ids to go after, in the order to claim them
+    sets: List[int]
+    value: int
+    # False when the time budget ran out before the search finished
+    optimal: bool
+    # Materials the chosen sets use up, before crafting intermediates
+    mat_needed: np.ndarray
+
+
+def _mat_needed(
+    cat: catalog.Catalog, needed: np.ndarray, furn_qty: np.ndarray
+) -> np.ndarray:
+    furn_short = np.maximum(needed - furn_qty, 0)
+    return np.where(cat.craftable, furn_short, 0) @ cat.recipes
+
+
+def _fitting(
+    cat: catalog.Catalog,
+    needed: np.ndarray,
+    set_ids: List[int],
+    furn_qty: np.ndarray,
+    mat_qty: np.ndarray,
+) -> np.ndarray:
+    # Which of the sets could still be added on top of what is needed so far.
+    # Short crafted materials are fine as long as what they're made of is there.
+    with_sets = np.maximum(needed, cat.set_amounts[set_ids])
+    (_, short) = catalog.expand_materials(
+        cat, _mat_needed(cat, with_sets, furn_qty), mat_qty
+    )
+    return ~short[:, ~cat.craftable_materials].any(axis=1)
+
+
+def plan_claims(
+    cat: catalog.Catalog,
+    owned: np.ndarray,
+    claimed: np.ndarray,
+    furn_qty: np.ndarray,
+    mat_qty: np.ndarray,
+    rewards: bool = False,
+    budget: float = 0.2,
+) -> ClaimPlan:
+    # Picks the pending sets to claim with the materials on hand, maximizing
+    # the number of sets, or with rewards the number of characters that can
+    # claim them. Furnishings shared by sets are only needed once, at the
+    # largest amount any chosen set asks for.
+    deadline = time.perf_counter() + budget
+    open_pairs = ~claimed & owned[cat.pair_char]
+    open_count = np.bincount(cat.pair_set[open_pairs], minlength=len(cat.set_names))
+    values = open_count if rewards else (open_count > 0).astype(np.int64)
+
+    # Cheapest per unit of value first, a material costing its share of stock
+    set_ids = np.flatnonzero(values)
+    mat_needed = _mat_needed(cat, cat.set_amounts[set_ids], furn_qty)
+    cost = (mat_needed / (mat_qty + 1)).sum(axis=1) / values[set_ids]
+    order = set_ids[np.argsort(cost, kind="stable")].tolist()
+
+    best = {"sets": [], "value": 0}
+    optimal = True
+
+    def search(sets: List[int], chosen: List[int], value: int, needed: np.ndarray):
+        nonlocal optimal
+        if value > best["value"]:
+            best.update(sets=list(chosen), value=value)
+        if not sets:
+            return
+
+        # Only the sets that still fit can add to this branch
+        sets = [
+            s
+            for s, fits in zip(sets, _fitting(cat, needed, sets, furn_qty, mat_qty))
+            if fits
+        ]
+        if value + values[sets].sum() <= best["value"]:
+            return
+        if time.perf_counter() > deadline:
+            optimal = False
+            return
+
+        # Taking a set first makes the first leaf the greedy answer
+        (set_id, rest) = (sets[0], sets[1:])
+        chosen.append(set_id)
+        search(
+            rest,
+            chosen,
+            value + values[set_id],
+            np.maximum(needed, cat.set_amounts[set_id]),
+        )
+        chosen.pop()
+        search(rest, chosen, value, needed)
+
+    search(order, [], 0, np.zeros(len(cat.furnishings), dtype=np.int64))
+
+    needed = cat.set_amounts[best["sets"]].max(axis=0, initial=0)
+    return ClaimPlan(
+        sets=best["sets"],
+        value=int(best["value"]),
+        optimal=optimal,
+        mat_needed=_mat_needed(cat, needed, furn_qty),
+    )
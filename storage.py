@@ -0,0 +1,401 @@
+from typing import Dict, List, Optional, Tuple
+import abc
+import hashlib
+import json
+import sqlite3
+import threading
+import numpy as np
+import catalog
+
+# Sets, then character, material and furnishing names in collection order, then
+# the recipes of the materials that are crafted from other materials
+CatalogDocs = Tuple[List[dict], List[str], List[str], List[str], Dict[str, List[dict]]]
+
+
+def apply_change(user_inventory: dict, path: str, value) -> None:
+    # Apply a dotted-path $set like "sets.3.characters.Nahida" to a document
+    *parents, leaf = path.split(".")
+    target = user_inventory
+    for part in parents:
+        target = target[int(part)] if isinstance(target, list) else target[part]
+    target[leaf] = value
+
+
+class Storage(abc.ABC):
+    @abc.abstractmethod
+    def catalog_version(self) -> int:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def catalog_docs(self) -> CatalogDocs:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_inventory(self, user_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert_inventory(self, user_inventory: dict) -> None:
+        raise NotImplementedError
+
+    # True if there was an inventory to delete
+    @abc.abstractmethod
+    def delete_inventory(self, user_id: str) -> bool:
+        raise NotImplementedError
+
+    # Applies dotted-path changes and appends new sets, but only if the stored
+    # document is still at the given revision, with `set_count` sets. The
+    # revision moves by the number of edits merged into the update.
+    @abc.abstractmethod
+    def update_inventory(
+        self,
+        user_id: str,
+        revision: int,
+        set_count: int,
+        changes: dict,
+        new_sets: List[dict],
+        edits: int = 1,
+    ) -> bool:
+        raise NotImplementedError
+
+    # The stored requirements of a user, as computed by snapshots.compute_batch
+    @abc.abstractmethod
+    def find_requirements(self, user_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_requirements(self, results: List[dict]) -> None:
+        raise NotImplementedError
+
+
+class MongoStorage(Storage):
+    def __init__(self, db: "pymongo.database.Database"):
+        self.db = db
+
+    def catalog_version(self) -> int:
+        meta = self.db.meta.find_one({"_id": "catalog"}, {"version": 1})
+        return meta["version"] if meta else 0
+
+    def catalog_docs(self) -> CatalogDocs:
+        characters = self.db.characters.find({}, {"character_name": 1, "_id": 0})
+        materials = list(self.db.materials.find({}, {"name": 1, "recipe": 1, "_id": 0}))
+        furnishings = self.db.furnishings.find({}, {"name": 1, "_id": 0})
+
+        return (
+            list(self.db.sets.find({}, {"_id": 0})),
+            [char["character_name"] for char in characters],
+            [mat["name"] for mat in materials],
+            [furn["name"] for furn in furnishings],
+            {mat["name"]: mat["recipe"] for mat in materials if mat.get("recipe")},
+        )
+
+    def find_inventory(self, user_id: str) -> Optional[dict]:
+        import schema
+
+        user_inventory = self.db.inventory.find_one(
+            {"user_id": user_id}, schema.INVENTORY_FIELDS
+        )
+
+        # Documents written before revisions existed start at zero
+        if user_inventory is not None and "revision" not in user_inventory:
+            self.db.inventory.update_one(
+                {"_id": user_inventory["_id"], "revision": {"$exists": False}},
+                {"$set": {"revision": 0}},
+            )
+            user_inventory["revision"] = 0
+
+        return user_inventory
+
+    def insert_inventory(self, user_inventory: dict) -> None:
+        self.db.inventory.insert_one(user_inventory)
+
+    def delete_inventory(self, user_id: str) -> bool:
+        self.db.requirements.delete_one({"user_id": user_id})
+        return self.db.inventory.delete_one({"user_id": user_id}).deleted_count > 0
+
+    def update_inventory(
+        self,
+        user_id: str,
+        revision: int,
+        set_count: int,
+        changes: dict,
+        new_sets: List[dict],
+        edits: int = 1,
+    ) -> bool:
+        # New sets are set at the positions after the stored ones, since Mongo
+        # refuses a $push to sets in the same update as a change in sets.N
+        appended = {
+            f"sets.{set_count + pos}": new_set for pos, new_set in enumerate(new_sets)
+        }
+        update = {"$inc": {"revision": edits}}
+        if changes or appended:
+            update["$set"] = {**changes, **appended}
+
+        query = {"user_id": user_id, "revision": revision}
+        if new_sets:
+            # A wrong count would leave nulls in between
+            query["sets"] = {"$size": set_count}
+        result = self.db.inventory.update_one(query, update)
+
+        return result.matched_count > 0
+
+    def find_requirements(self, user_id: str) -> Optional[dict]:
+        return self.db.requirements.find_one({"user_id": user_id}, {"_id": 0})
+
+    def save_requirements(self, results: List[dict]) -> None:
+        from pymongo import UpdateOne
+
+        if results:
+            self.db.requirements.bulk_write(
+                [
+                    UpdateOne(
+                        {"user_id": result["user_id"]}, {"$set": result}, upsert=True
+                    )
+                    for result in results
+                ],
+                ordered=False,
+            )
+
+
+class EmbeddedStorage(Storage):
+    # A single SQLite file seeded from the bundled sets.json. Inventories are
+    # stored as one row per user, each field packed into a blob in catalog
+    # order: bitsets for owned characters and claimed pairs, int32 arrays for
+    # quantities. The column order of every catalog version is kept so rows
+    # written under an older catalog still decode, and the order of the stored
+    # sets is kept so dotted paths like "sets.3..." mean the same as in Mongo.
+
+    def __init__(self, path: str, catalog_path: str = "sets.json"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.layouts = {}
+        with self.lock, self.conn:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY, value TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sets (
+                    name TEXT PRIMARY KEY, doc TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS inventory (
+                    user_id TEXT PRIMARY KEY,
+                    revision INTEGER NOT NULL,
+                    catalog_version INTEGER NOT NULL,
+                    characters BLOB NOT NULL,
+                    claimed BLOB NOT NULL,
+                    materials BLOB NOT NULL,
+                    furnishings BLOB NOT NULL,
+                    set_order TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS requirements (
+                    user_id TEXT PRIMARY KEY,
+                    catalog_version INTEGER NOT NULL,
+                    doc TEXT NOT NULL
+                );
+                """
+            )
+        self.seed(catalog_path)
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        row = row.fetchone()
+        return row[0] if row else None
+
+    def seed(self, catalog_path: str) -> None:
+        with open(catalog_path, "rb") as file:
+            source = file.read()
+        digest = hashlib.sha256(source).hexdigest()
+
+        # Only reseed, and bump the catalog version, when the source changed
+        with self.lock, self.conn:
+            if self._meta("catalog_digest") == digest:
+                return
+
+            set_docs = json.loads(source)
+            version = int(self._meta("catalog_version") or 0) + 1
+            cat = catalog.compile_catalog(set_docs)
+            layout = {
+                "characters": cat.characters.tolist(),
+                "pairs": [list(pair) for pair in cat.pairs],
+                "materials": cat.materials.tolist(),
+                "furnishings": cat.furnishings.tolist(),
+            }
+
+            self.conn.execute("DELETE FROM sets")
+            self.conn.executemany(
+                "INSERT INTO sets (name, doc) VALUES (?, ?)",
+                [(doc["name"], json.dumps(doc)) for doc in set_docs],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [
+                    ("catalog_digest", digest),
+                    ("catalog_version", str(version)),
+                    (f"layout:{version}", json.dumps(layout)),
+                ],
+            )
+
+    def _layout(self, version: int) -> dict:
+        if version not in self.layouts:
+            self.layouts[version] = json.loads(self._meta(f"layout:{version}"))
+        return self.layouts[version]
+
+    def catalog_version(self) -> int:
+        with self.lock:
+            return int(self._meta("catalog_version") or 0)
+
+    def catalog_docs(self) -> CatalogDocs:
+        with self.lock:
+            rows = self.conn.execute("SELECT doc FROM sets ORDER BY name").fetchall()
+
+        # The names are derived from the sets themselves
+        return ([json.loads(row[0]) for row in rows], [], [], [], {})
+
+    def _decode(self, row: tuple) -> dict:
+        (user_id, revision, version, characters, claimed) = row[:5]
+        (materials, furnishings, set_order) = row[5:]
+        layout = self._layout(version)
+        owned = np.unpackbits(
+            np.frombuffer(characters, np.uint8), count=len(layout["characters"])
+        )
+        claims = np.unpackbits(
+            np.frombuffer(claimed, np.uint8), count=len(layout["pairs"])
+        )
+
+        sets = {name: {} for name in json.loads(set_order)}
+        for (name, char), value in zip(layout["pairs"], claims.tolist()):
+            if name in sets:
+                sets[name][char] = bool(value)
+
+        return {
+            "user_id": user_id,
+            "revision": revision,
+            "characters": dict(zip(layout["characters"], map(bool, owned.tolist()))),
+            "materials": dict(
+                zip(layout["materials"], np.frombuffer(materials, np.int32).tolist())
+            ),
+            "furnishings": dict(
+                zip(
+                    layout["furnishings"],
+                    np.frombuffer(furnishings, np.int32).tolist(),
+                )
+            ),
+            "sets": [
+                {"name": name, "characters": chars} for name, chars in sets.items()
+            ],
+        }
+
+    def _encode(self, user_inventory: dict, version: int) -> tuple:
+        layout = self._layout(version)
+        claims = {
+            (stored["name"], char): value
+            for stored in user_inventory["sets"]
+            for char, value in stored["characters"].items()
+        }
+
+        def quantities(field):
+            stored = user_inventory[field]
+            return np.array(
+                [stored.get(name) or 0 for name in layout[field]], dtype=np.int32
+            ).tobytes()
+
+        return (
+            np.packbits(
+                [
+                    bool(user_inventory["characters"].get(name))
+                    for name in layout["characters"]
+                ]
+            ).tobytes(),
+            np.packbits(
+                [bool(claims.get(tuple(pair))) for pair in layout["pairs"]]
+            ).tobytes(),
+            quantities("materials"),
+            quantities("furnishings"),
+            json.dumps([stored["name"] for stored in user_inventory["sets"]]),
+        )
+
+    def _select(self, user_id: str) -> Optional[tuple]:
+        return self.conn.execute(
+            "SELECT user_id, revision, catalog_version, characters, claimed,"
+            " materials, furnishings, set_order FROM inventory WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+
+    def find_inventory(self, user_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self._select(user_id)
+            return self._decode(row) if row else None
+
+    def insert_inventory(self, user_inventory: dict) -> None:
+        with self.lock, self.conn:
+            version = int(self._meta("catalog_version"))
+            self.conn.execute(
+                "INSERT INTO inventory VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user_inventory["user_id"],
+                    user_inventory["revision"],
+                    version,
+                    *self._encode(user_inventory, version),
+                ),
+            )
+
+    def delete_inventory(self, user_id: str) -> bool:
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM requirements WHERE user_id = ?", (user_id,))
+            cursor = self.conn.execute(
+                "DELETE FROM inventory WHERE user_id = ?", (user_id,)
+            )
+            return cursor.rowcount > 0
+
+    def update_inventory(
+        self,
+        user_id: str,
+        revision: int,
+        set_count: int,
+        changes: dict,
+        new_sets: List[dict],
+        edits: int = 1,
+    ) -> bool:
+        with self.lock, self.conn:
+            row = self._select(user_id)
+            if row is None or row[1] != revision:
+                return False
+
+            user_inventory = self._decode(row)
+            for path, value in changes.items():
+                apply_change(user_inventory, path, value)
+            user_inventory["sets"].extend(new_sets)
+
+            # Rows are rewritten in the current catalog's column order
+            version = int(self._meta("catalog_version"))
+            self.conn.execute(
+                "UPDATE inventory SET revision = ?, catalog_version = ?,"
+                " characters = ?, claimed = ?, materials = ?, furnishings = ?,"
+                " set_order = ? WHERE user_id = ?",
+                (
+                    revision + edits,
+                    version,
+                    *self._encode(user_inventory, version),
+                    user_id,
+                ),
+            )
+
+            return True
+
+    def find_requirements(self, user_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT doc FROM requirements WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            return json.loads(row[0]) if row else None
+
+    def save_requirements(self, results: List[dict]) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO requirements VALUES (?, ?, ?)",
+                [
+                    (result["user_id"], result["catalog_version"], json.dumps(result))
+                    for result in results
+                ],
+            )
@@ -0,0 +1,208 @@
+from typing import Dict, Iterable, Iterator, List, Set, TextIO
+import argparse
+import json
+import pymongo.collection
+import pymongo.database
+from pymongo import UpdateOne
+from pymongo.server_api import ServerApi
+from pymongo.mongo_client import MongoClient
+import schema
+
+# The field each catalog collection is keyed by
+KEYS = {
+    "sets": "name",
+    "furnishings": "name",
+    "materials": "name",
+    "characters": "character_name",
+}
+
+
+def iter_json_array(file: TextIO, chunk_size: int = 1 << 16) -> Iterator[dict]:
+    # Decodes the objects of a top-level array one at a time, reading the file
+    # in chunks so the whole document is never held in memory
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    started = False
+
+    while True:
+        # Skip whitespace and the separators between elements
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+            if buffer[pos] == "[":
+                started = True
+            pos += 1
+        if pos < len(buffer):
+            if not started:
+                raise ValueError("Expected a JSON array")
+            try:
+                doc, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield doc
+                pos = end
+                continue
+        elif eof:
+            return
+
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def _batches(docs: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def sync_batch(
+    collection: pymongo.collection.Collection,
+    key: str,
+    docs: List[dict],
+    dry_run: bool = False,
+) -> int:
+    # One read and at most one write per batch, unchanged documents are skipped
+    fields = {field: 1 for doc in docs for field in doc}
+    existing = {
+        doc[key]: doc
+        for doc in collection.find(
+            {key: {"$in": [doc[key] for doc in docs]}}, {"_id": 0, **fields}
+        )
+    }
+    changed = [
+        UpdateOne({key: doc[key]}, {"$set": doc}, upsert=True)
+        for doc in docs
+        if existing.get(doc[key]) != doc
+    ]
+
+    if changed and not dry_run:
+        collection.bulk_write(changed, ordered=False)
+
+    return len(changed)
+
+
+def _derive(set_doc: dict, derived: Dict[str, Dict[str, dict]]) -> None:
+    # The first recipe listed for a furnishing wins, as in compile_catalog
+    for char in set_doc.get("characters", []):
+        derived["characters"].setdefault(char, {"character_name": char})
+    for furn in set_doc.get("materials", []):
+        derived["furnishings"].setdefault(
+            furn["name"], {"name": furn["name"], "recipe": furn["recipe"]}
+        )
+        for mat in furn["recipe"]:
+            derived["materials"].setdefault(mat["name"], {"name": mat["name"]})
+
+
+def _recipe_closure(
+    collection: pymongo.collection.Collection, names: Iterable[str]
+) -> Set[str]:
+    # Parts of the kept materials' own recipes are kept too, however deep,
+    # since no furnishing may list them directly
+    recipes = {
+        doc["name"]: doc["recipe"]
+        for doc in collection.find(
+            {"recipe": {"$exists": True}}, {"_id": 0, "name": 1, "recipe": 1}
+        )
+    }
+    kept = set(names)
+    pending = list(kept)
+    while pending:
+        for part in recipes.get(pending.pop()) or []:
+            if part["name"] not in kept:
+                kept.add(part["name"])
+                pending.append(part["name"])
+
+    return kept
+
+
+def sync_catalog(
+    db: pymongo.database.Database,
+    source_path: str = "sets.json",
+    batch_size: int = 500,
+    prune: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    changes = {collection: 0 for collection in KEYS}
+    derived = {collection: {} for collection in KEYS if collection != "sets"}
+    names = set()
+
+    with open(source_path, encoding="utf-8") as file:
+        for docs in _batches(iter_json_array(file), batch_size):
+            for doc in docs:
+                names.add(doc["name"])
+                _derive(doc, derived)
+            changes["sets"] += sync_batch(db.sets, KEYS["sets"], docs, dry_run)
+
+    for collection, docs in derived.items():
+        for batch in _batches(docs.values(), batch_size):
+            changes[collection] += sync_batch(
+                db[collection], KEYS[collection], batch, dry_run
+            )
+
+    # Documents the source no longer lists are kept unless asked otherwise
+    if prune:
+        kept = {"sets": names, **{name: set(docs) for name, docs in derived.items()}}
+        kept["materials"] = _recipe_closure(db.materials, kept["materials"])
+        for collection, key in KEYS.items():
+            stale = {key: {"$nin": list(kept[collection])}}
+            if dry_run:
+                changes[collection] += db[collection].count_documents(stale)
+            else:
+                changes[collection] += db[collection].delete_many(stale).deleted_count
+
+    # Running apps reload the catalog when its version moves
+    if any(changes.values()) and not dry_run:
+        db.meta.update_one({"_id": "catalog"}, {"$inc": {"version": 1}}, upsert=True)
+
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bring the catalog collections in line with sets.json"
+    )
+    parser.add_argument("--uri", help="MongoDB URI, defaults to the app's secrets")
+    parser.add_argument("--source", default="sets.json")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--prune", action="store_true", help="delete documents not in the source"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only report what would change"
+    )
+    parser.add_argument(
+        "--skip-requirements",
+        action="store_true",
+        help="don't recompute the stored requirements after a change",
+    )
+    args = parser.parse_args()
+
+    if args.uri:
+        db = MongoClient(args.uri, server_api=ServerApi("1")).furnishings
+    else:
+        import streamlit as st
+
+        db = MongoClient(
+            st.secrets["mongo"]["uri"], server_api=ServerApi("1")
+        ).furnishings
+
+    schema.ensure_indexes(db)
+    changes = sync_catalog(
+        db, args.source, args.batch_size, prune=args.prune, dry_run=args.dry_run
+    )
+    for collection, count in changes.items():
+        print(f"{collection}: {count} changed")
+
+    # Stored requirements are recomputed once here for every user, rather
+    # than by each app process noticing the new version
+    if any(changes.values()) and not args.dry_run and not args.skip_requirements:
+        import bulk
+
+        print(f"requirements: {bulk.run(db, args.batch_size)} users recomputed")
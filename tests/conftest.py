@@ -0,0 +1,20 @@
+import os
+import uuid
+import pytest
+
+# Tests marked `mongo` run against a real mongod, since mongomock accepts
+# updates that MongoDB refuses. Point MONGO_TEST_URI at a disposable server.
+MONGO_TEST_URI = os.environ.get("MONGO_TEST_URI")
+
+mongo = pytest.mark.skipif(not MONGO_TEST_URI, reason="MONGO_TEST_URI not set")
+
+
+@pytest.fixture
+def db():
+    from pymongo.mongo_client import MongoClient
+
+    client = MongoClient(MONGO_TEST_URI)
+    name = f"furnishings_test_{uuid.uuid4().hex[:8]}"
+    yield client[name]
+    client.drop_database(name)
+    client.close()
@@ -0,0 +1,84 @@
+import pytest
+import storage
+import writes
+from conftest import mongo
+
+pytestmark = mongo
+
+
+@pytest.fixture
+def store(db):
+    return storage.MongoStorage(db)
+
+
+def _inventory(user_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "revision": 0,
+        "characters": {"Nahida": True},
+        "materials": {"Wood": 3},
+        "furnishings": {"Lamp": 1},
+        "sets": [{"name": "Garden", "characters": {"Nahida": False}}],
+    }
+
+
+def test_claims_in_stored_and_new_sets(store):
+    store.insert_inventory(_inventory("user"))
+
+    assert store.update_inventory(
+        "user",
+        0,
+        1,
+        {"sets.0.characters.Nahida": True, "materials.Wood": 5},
+        [{"name": "Pond", "characters": {"Nahida": True}}],
+    )
+
+    stored = store.find_inventory("user")
+    assert stored["revision"] == 1
+    assert stored["materials"]["Wood"] == 5
+    assert stored["sets"] == [
+        {"name": "Garden", "characters": {"Nahida": True}},
+        {"name": "Pond", "characters": {"Nahida": True}},
+    ]
+
+
+def test_stale_revision_or_set_count_is_refused(store):
+    store.insert_inventory(_inventory("user"))
+    new_set = {"name": "Pond", "characters": {"Nahida": True}}
+
+    assert not store.update_inventory("user", 1, 1, {}, [new_set])
+    assert not store.update_inventory("user", 0, 2, {}, [new_set])
+    assert store.find_inventory("user")["sets"] == _inventory("user")["sets"]
+
+
+def test_merged_saves(store):
+    store.insert_inventory(_inventory("user"))
+
+    # Two saves merged by the write queue, each claiming in a stored set and
+    # adding a set, the second one also claiming in the set the first added
+    writes.submit(
+        store,
+        "user",
+        0,
+        1,
+        {"sets.0.characters.Nahida": True},
+        [{"name": "Pond", "characters": {"Nahida": True, "Tighnari": False}}],
+    )
+    writes.submit(
+        store,
+        "user",
+        1,
+        1,
+        {"sets.1.characters.Tighnari": True},
+        [{"name": "Hut", "characters": {"Tighnari": True}}],
+    )
+    assert writes.flush("user")
+
+    stored = store.find_inventory("user")
+    assert stored["revision"] == 2
+    assert [stored_set["name"] for stored_set in stored["sets"]] == [
+        "Garden",
+        "Pond",
+        "Hut",
+    ]
+    assert stored["sets"][1]["characters"] == {"Nahida": True, "Tighnari": True}
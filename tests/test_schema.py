@@ -0,0 +1,30 @@
+import pytest
+import schema
+from conftest import mongo
+
+pytestmark = mongo
+
+
+def test_duplicate_users_are_reported_then_deduped(db):
+    db.inventory.insert_many(
+        [
+            {"user_id": "a", "revision": 2},
+            {"user_id": "a", "revision": 5},
+            {"user_id": "a", "revision": 5},
+            {"user_id": "b", "revision": 0},
+        ]
+    )
+
+    with pytest.raises(ValueError, match="schema.py --dedupe"):
+        schema.ensure_indexes(db)
+
+    latest = max(
+        db.inventory.find({"user_id": "a", "revision": 5}), key=lambda d: d["_id"]
+    )
+    assert schema.dedupe(db)["inventory"] == 2
+    schema.ensure_indexes(db)
+
+    assert sorted(doc["_id"] for doc in db.inventory.find()) == sorted(
+        [latest["_id"], db.inventory.find_one({"user_id": "b"})["_id"]]
+    )
+    assert db.inventory_duplicates.count_documents({"user_id": "a"}) == 2
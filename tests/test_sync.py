@@ -0,0 +1,48 @@
+import json
+import sync
+from conftest import mongo
+
+pytestmark = mongo
+
+
+def test_prune_keeps_material_recipe_parts(db, tmp_path):
+    source = tmp_path / "sets.json"
+    source.write_text(
+        json.dumps(
+            [
+                {
+                    "name": "Garden",
+                    "characters": ["Nahida"],
+                    "materials": [
+                        {"name": "Rug", "recipe": [{"name": "Fabric", "quantity": 2}]}
+                    ],
+                }
+            ]
+        ),
+        encoding="utf-8",
+    )
+    sync.sync_catalog(db, str(source))
+
+    # Fabric is made from Silk Flower, which is made from Seed; no furnishing
+    # lists either of them
+    db.materials.update_one(
+        {"name": "Fabric"},
+        {"$set": {"recipe": [{"name": "Silk Flower", "quantity": 1}]}},
+    )
+    db.materials.insert_many(
+        [
+            {"name": "Silk Flower", "recipe": [{"name": "Seed", "quantity": 3}]},
+            {"name": "Seed"},
+            {"name": "Dye", "recipe": [{"name": "Ink", "quantity": 1}]},
+            {"name": "Ink"},
+        ]
+    )
+
+    changes = sync.sync_catalog(db, str(source), prune=True)
+
+    assert changes["materials"] == 2
+    assert sorted(doc["name"] for doc in db.materials.find()) == [
+        "Fabric",
+        "Seed",
+        "Silk Flower",
+    ]
@@ -0,0 +1,257 @@
+import pandas as pd
+import streamlit as st
+import data_controller as data
+import metrics
+
+# Each tab is a fragment, so an edit only reruns its own tab and the
+# requirements instead of the whole script. The tabs share their edited
+# frames through the session.
+
+
+def _rerun_with_requirements(fragment: str) -> None:
+    st.rerun([fragment, "requirements"])
+
+
+def _edited(kind: str, frame: pd.DataFrame) -> None:
+    st.session_state.setdefault("edited_frames", {})[kind] = frame
+
+
+def notify_save_failed() -> None:
+    if data.save_failed():
+        st.error(
+            "Some changes could not be saved because the data was changed elsewhere. It has been reloaded, check it and save again."
+        )
+
+
+def _get_data():
+    # Every tab checks for failed saves, as most reruns only rerun a tab
+    loaded = data.get_data()
+    notify_save_failed()
+
+    return loaded
+
+
+def _saved(written: bool) -> None:
+    if written:
+        st.success("Changes accepted, they are written within a few seconds.")
+    else:
+        st.error("Changes not accepted, the data was reloaded. Please try again.")
+
+
+@st.fragment(key="characters")
+def characters_tab() -> None:
+    with metrics.span("characters tab"):
+        (store, chars_list, _, _, _) = _get_data()
+        st.header("Characters")
+        char_df = st.data_editor(
+            chars_list,
+            column_config={
+                "owned": st.column_config.CheckboxColumn(
+                    "Owned?",
+                    help="Select your **owned** characters",
+                    default=False,
+                )
+            },
+            disabled=["character_name"],
+            hide_index=True,
+            key="characters_editor",
+            on_change=_rerun_with_requirements,
+            args=("characters",),
+        )
+        _edited("characters", char_df)
+
+        if st.button("Save changes", key="save_chars", type="primary"):
+            _saved(data.update_chars(store, char_df))
+
+        st.subheader("What does a character unlock?")
+        character = st.selectbox(
+            "Character",
+            chars_list["character_name"],
+            index=None,
+            key="character_sets",
+        )
+        if character is not None:
+            st.dataframe(
+                data.character_sets(character),
+                column_config={"name": "Gift set"},
+                hide_index=True,
+            )
+
+
+@st.fragment(key="materials")
+def materials_tab() -> None:
+    with metrics.span("materials tab"):
+        (store, _, mats_list, _, _) = _get_data()
+        st.header("Materials")
+        mat_df = st.data_editor(
+            mats_list,
+            column_config={
+                "quantity": st.column_config.NumberColumn(
+                    "Quantity owned",
+                    help="Quantity of the materials you own",
+                    min_value=0,
+                    max_value=20000,
+                    step=1,
+                )
+            },
+            disabled=["name"],
+            hide_index=True,
+            key="materials_editor",
+            on_change=_rerun_with_requirements,
+            args=("materials",),
+        )
+        _edited("materials", mat_df)
+
+        if st.button("Save changes", key="save_mats", type="primary"):
+            _saved(data.update_mats(store, mat_df))
+
+        st.subheader("Where is a material used?")
+        material = st.selectbox(
+            "Material", mats_list["name"], index=None, key="material_uses"
+        )
+        if material is not None:
+            uses = data.material_uses(material)
+            if uses.empty:
+                st.write("No furnishing is crafted from it.")
+            else:
+                st.dataframe(
+                    uses,
+                    column_config={
+                        "name": "Furnishing",
+                        "quantity": "Needed per furnishing",
+                        "sets": "Gift sets needing the furnishing",
+                    },
+                    hide_index=True,
+                )
+
+
+@st.fragment(key="furnishings")
+def furnishings_tab() -> None:
+    with metrics.span("furnishings tab"):
+        (store, _, _, furn_list, _) = _get_data()
+        st.header("Furnishings")
+        furn_df = st.data_editor(
+            furn_list,
+            column_config={
+                "quantity": st.column_config.NumberColumn(
+                    "Quantity owned",
+                    help="Quantity of the furnishings you own",
+                    min_value=0,
+                    max_value=20000,
+                    step=1,
+                )
+            },
+            disabled=["name"],
+            hide_index=True,
+            key="furnishings_editor",
+            on_change=_rerun_with_requirements,
+            args=("furnishings",),
+        )
+        _edited("furnishings", furn_df)
+
+        if st.button("Save changes", key="save_furn", type="primary"):
+            _saved(data.update_furns(store, furn_df))
+
+        st.subheader("Where is a furnishing used?")
+        furnishing = st.selectbox(
+            "Furnishing", furn_list["name"], index=None, key="furnishing_uses"
+        )
+        if furnishing is not None:
+            st.dataframe(
+                data.furnishing_uses(furnishing),
+                column_config={"name": "Gift set", "amount": "Amount needed"},
+                hide_index=True,
+            )
+
+
+@st.fragment(key="sets")
+def sets_tab() -> None:
+    with metrics.span("sets tab"):
+        (store, _, _, _, sets_list) = _get_data()
+        st.header("Gift Sets")
+        sets_df = st.data_editor(
+            sets_list,
+            column_config={
+                "claimed": st.column_config.CheckboxColumn(
+                    "Claimed?",
+                    help="Check the characters you have claimed rewards for",
+                    default=False,
+                )
+            },
+            disabled=["name", "characters"],
+            hide_index=True,
+            key="sets_editor",
+            on_change=_rerun_with_requirements,
+            args=("sets",),
+        )
+        _edited("sets", sets_df)
+
+        if st.button("Save changes", key="save_sets", type="primary"):
+            _saved(data.update_sets(store, sets_df))
+
+
+@st.fragment(key="requirements")
+def requirements_tab() -> None:
+    with metrics.span("requirements tab"):
+        st.header("Requirements")
+        (store, _, _, _, _) = _get_data()
+        edited = st.session_state.edited_frames
+        frames = (
+            edited["characters"],
+            edited["sets"],
+            edited["furnishings"],
+            edited["materials"],
+        )
+        # Saved inventories read their stored requirements when up to date
+        snapshot = None
+        if not data.unsaved_edits(*frames):
+            snapshot = data.requirements_snapshot(store)
+        if snapshot is None:
+            reqs = data.live_requirements(*frames)
+        else:
+            reqs = data.snapshot_frames(snapshot)
+
+        if reqs:
+            (needed_furns, buy_furns, needed_mats) = reqs
+
+            cols = st.columns(2)
+            with cols[0]:
+                st.subheader("Furnishings to buy:")
+                st.dataframe(
+                    buy_furns[["name", "amount"]],
+                    hide_index=True,
+                )
+
+                st.subheader("Materials needed:")
+                st.dataframe(
+                    needed_mats[["name", "quantity_diff"]],
+                    hide_index=True,
+                )
+
+            with cols[1]:
+                st.subheader("Furnishings to craft:")
+                st.dataframe(
+                    needed_furns[["name", "amount"]],
+                    hide_index=True,
+                )
+
+            st.subheader("Claim first:")
+            rewards = st.toggle("Count each character's reward", key="claim_rewards")
+            # Searched for on request only, as the search can take a moment
+            plan = data.claim_order(*frames, rewards, compute=False)
+            if plan is None and st.button("Find what to claim", key="plan_claims"):
+                plan = data.claim_order(*frames, rewards)
+            if plan is None:
+                st.caption(
+                    "Finding the best choice takes a moment, so it is done on request."
+                )
+            elif plan[0].empty:
+                st.write("None of the gift sets can be made with what you have.")
+            else:
+                most = "rewards" if rewards else "gift sets"
+                st.write(f"The most {most} you can claim with what you have:")
+                st.dataframe(plan[0], hide_index=True)
+                if not plan[1]:
+                    st.caption("There may be a slightly better choice.")
+        else:
+            st.write("There are no gift sets to claim.")
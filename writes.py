@@ -0,0 +1,247 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+import atexit
+import copy
+import threading
+import time
+import metrics
+
+# Saves are held this long, so a user's saves in quick succession are merged
+# into one write, and at most this many users can have saves waiting
+WRITE_WINDOW = 2.0
+MAX_PENDING = 1000
+
+_cond = threading.Condition()
+# Writes waiting for their window to pass by user id, oldest first
+_pending: "OrderedDict[str, PendingWrite]" = OrderedDict()
+# Users whose write is going to storage right now
+_writing: Set[str] = set()
+_state = {"thread": None, "closed": False}
+# Called with every write that made it to storage
+_listeners: List[Callable[["PendingWrite"], None]] = []
+
+
+class PendingWrite:
+    # The edits of one user merged into a single update. Every edit moved the
+    # user's revision by one, so the update moves it by the number of edits.
+    def __init__(
+        self,
+        store: "storage.Storage",
+        user_id: str,
+        revision: int,
+        set_count: int,
+        due: float,
+    ):
+        self.store = store
+        self.user_id = user_id
+        self.revision = revision
+        # Sets stored when the first edit was made, later ones are new sets
+        self.set_count = set_count
+        self.due = due
+        self.changes: Dict[str, object] = {}
+        self.new_sets: List[dict] = []
+        self.edits = 0
+        self.done = threading.Event()
+        self.written: Optional[bool] = None
+
+    def merge(self, changes: dict, new_sets: List[dict]) -> None:
+        # auth imports this module for the sign-in page, which has no use
+        # for the numpy that storage loads
+        import storage
+
+        for path, value in copy.deepcopy(changes).items():
+            # Changes to a set that is still waiting to be added go into it
+            (field, _, rest) = path.partition(".")
+            if field == "sets" and rest:
+                (pos, _, rest) = rest.partition(".")
+                if int(pos) >= self.set_count:
+                    new_set = self.new_sets[int(pos) - self.set_count]
+                    storage.apply_change(new_set, rest, value)
+                    continue
+
+            # Mongo refuses a path and its parent in one update, so a change
+            # under a replaced field goes into the replacement and a replaced
+            # field drops the changes under it
+            parent = next(
+                (key for key in self.changes if path.startswith(f"{key}.")), None
+            )
+            if parent is not None:
+                rest = path[len(parent) + 1 :]
+                storage.apply_change(self.changes[parent], rest, value)
+                continue
+            for key in [key for key in self.changes if key.startswith(f"{path}.")]:
+                del self.changes[key]
+            self.changes[path] = value
+
+        self.new_sets.extend(copy.deepcopy(new_sets))
+        self.edits += 1
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[bool]:
+        # True once written, False if the write failed, None until then
+        self.done.wait(timeout)
+        return self.written
+
+
+def _start() -> None:
+    if _state["thread"] is None:
+        _state["thread"] = threading.Thread(
+            target=_run, name="inventory-writes", daemon=True
+        )
+        _state["thread"].start()
+        atexit.register(close)
+
+
+def submit(
+    store: "storage.Storage",
+    user_id: str,
+    revision: int,
+    set_count: int,
+    changes: dict,
+    new_sets: List[dict],
+    timeout: float = 5.0,
+) -> Optional[PendingWrite]:
+    # Waits for room while the queue is full, and gives up with None after
+    # `timeout` seconds. None as well for a save conflicting with the pending
+    # one. Once the queue is closed, edits are written at once.
+    deadline = time.monotonic() + timeout
+    with _cond:
+        if not _state["closed"]:
+            _start()
+        if user_id not in _pending and len(_pending) >= MAX_PENDING:
+            metrics.inc("write_queue_waits_total")
+            while user_id not in _pending and len(_pending) >= MAX_PENDING:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.inc("write_queue_rejected_total")
+                    return None
+                _cond.wait(remaining)
+
+        write = _pending.get(user_id)
+        # A save made against an older revision than the pending one ends at,
+        # from another tab say, would overwrite its edits
+        if write is not None and revision != write.revision + write.edits:
+            metrics.inc("write_queue_conflicts_total")
+            return None
+        if write is None:
+            due = time.monotonic() + WRITE_WINDOW
+            write = PendingWrite(store, user_id, revision, set_count, due)
+            _pending[user_id] = write
+            _cond.notify_all()
+        write.merge(changes, new_sets)
+
+    if _state["closed"]:
+        flush(user_id)
+
+    return write
+
+
+def _write(write: PendingWrite) -> bool:
+    try:
+        with metrics.span("inventory write"):
+            written = write.store.update_inventory(
+                write.user_id,
+                write.revision,
+                write.set_count,
+                write.changes,
+                write.new_sets,
+                write.edits,
+            )
+        result = "written" if written else "conflict"
+    except Exception as error:
+        print(error)
+        (written, result) = (False, "error")
+    metrics.inc("inventory_writes_total", result=result)
+    metrics.inc("inventory_edits_total", write.edits)
+
+    with _cond:
+        _writing.discard(write.user_id)
+        _cond.notify_all()
+    write.written = written
+    write.done.set()
+    if written:
+        for listener in list(_listeners):
+            try:
+                listener(write)
+            except Exception as error:
+                print(error)
+
+    return written
+
+
+def _next_due(now: float) -> Optional[PendingWrite]:
+    for write in _pending.values():
+        if write.due > now:
+            return None
+        if write.user_id not in _writing:
+            return write
+
+    return None
+
+
+def _run() -> None:
+    while True:
+        with _cond:
+            write = _next_due(time.monotonic())
+            while write is None:
+                if _state["closed"]:
+                    return
+                waiting = [
+                    write.due
+                    for write in _pending.values()
+                    if write.user_id not in _writing
+                ]
+                _cond.wait(min(waiting) - time.monotonic() if waiting else None)
+                write = _next_due(time.monotonic())
+            del _pending[write.user_id]
+            _writing.add(write.user_id)
+            _cond.notify_all()
+
+        _write(write)
+
+
+def flush(user_id: str) -> Optional[bool]:
+    # Writes the user's pending edits now, after any write of theirs already
+    # in progress. None if there was nothing to write.
+    with _cond:
+        while user_id in _writing:
+            _cond.wait()
+        write = _pending.pop(user_id, None)
+        if write is None:
+            return None
+        _writing.add(user_id)
+        _cond.notify_all()
+
+    return _write(write)
+
+
+def close() -> None:
+    # Writes everything still pending, on shutdown
+    with _cond:
+        _state["closed"] = True
+        _cond.notify_all()
+        users = list(_pending)
+    for user_id in users:
+        flush(user_id)
+
+
+def on_written(listener: Callable[[PendingWrite], None]) -> None:
+    with _cond:
+        _listeners.append(listener)
+
+
+def is_pending(user_id: str) -> bool:
+    with _cond:
+        return user_id in _pending or user_id in _writing
+
+
+def _depth():
+    with _cond:
+        edits = sum(write.edits for write in _pending.values())
+        return [
+            ("write_queue_depth", {}, len(_pending)),
+            ("write_queue_edits", {}, edits),
+            ("write_queue_writing", {}, len(_writing)),
+        ]
+
+
+metrics.register(_depth)